@@ -0,0 +1,198 @@
+from concurrent.futures import ProcessPoolExecutor
+import datetime as dt
+import json
+
+from pyfahrplan.config import (
+    check_speaker_match,
+    config_defaults as cli_defaults,
+    conferences_matching,
+)
+from pyfahrplan.server import QUERY_PARAMETERS, _parse_bool
+
+# default of the cli's --conference, a spec without conference queries the same talks as the cli
+DEFAULT_CONFERENCE = "rc3-2021"
+# spec keys besides the filters of QUERY_PARAMETERS
+RESULT_OPTIONS = ("id", "now_next", "search", "limit", "sort", "reverse")
+
+
+def read_specs(lines) -> list:
+    """
+    Parses a JSONL file of query specs, lines that are not a JSON object become {"error": ...}
+
+    A spec takes the filters of the cli (speaker, speaker_match, title, track, day, start, room,
+    conference, no_past) plus now_next, search, limit, sort and reverse. Its "id" tags its results, the
+    line number is used if it has none.
+    """
+    specs = []
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+            if not isinstance(spec, dict):
+                raise ValueError("a spec must be a JSON object")
+        except ValueError as e:
+            spec = {"error": f"line {line_number}: {e}"}
+        spec.setdefault("id", line_number)
+        specs.append(spec)
+    return specs
+
+
+class BatchEvaluator:
+    """
+    Evaluates many specs against one loaded Fahrplan
+
+    The talks matching a single filter (e.g. conference=36c3 or room=Ada) are computed once and
+    shared by every spec that uses the same filter, a spec only intersects them.
+    """
+
+    def __init__(self, fahrplan, now: dt.datetime = None):
+        self.fahrplan = fahrplan
+        self.now = dt.datetime.now().astimezone() if now is None else now
+        # (filter, value) -> positions of the matching talks, None if the filter matches all
+        self._positions = {}
+        self._now_next = None
+
+    def _filter_positions(self, key: tuple):
+        """
+        key is a tuple of (Query argument, value) pairs that are checked together
+        """
+        if key not in self._positions:
+            from pyfahrplan.lib import Query
+
+            query = Query(now=self.now, **dict(key))
+            if not query.predicates:
+                self._positions[key] = None
+            else:
+                self._positions[key] = [
+                    position
+                    for position, talk in enumerate(self.fahrplan.flat_plans)
+                    if query.matches(talk)
+                ]
+        return self._positions[key]
+
+    def _query_arguments(self, spec: dict) -> dict:
+        unknown = set(spec) - set(QUERY_PARAMETERS) - set(RESULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown options {', '.join(sorted(unknown))}")
+        arguments = {"conference": DEFAULT_CONFERENCE}
+        for parameter, (argument, parameter_type) in QUERY_PARAMETERS.items():
+            value = spec.get(parameter)
+            if value is None:
+                continue
+            if parameter_type is bool:
+                arguments[argument] = _parse_bool(value) if isinstance(value, str) else bool(value)
+            else:
+                arguments[argument] = parameter_type(value)
+        return arguments
+
+    def evaluate(self, spec: dict) -> dict:
+        """
+        {"id": ..., "talks": [...]} for one spec, or {"id": ..., "error": ...}
+        """
+        from pyfahrplan.lib import select_talks
+
+        if "error" in spec:
+            return {"id": spec.get("id"), "error": spec["error"]}
+        try:
+            arguments = self._query_arguments(spec)
+            speaker_match = check_speaker_match(
+                arguments.pop("speaker_match", cli_defaults["speaker_match"])
+            )
+            # how the speaker is matched is part of the speaker filter
+            filters = [
+                (("speaker", value), ("speaker_match", speaker_match))
+                if argument == "speaker"
+                else ((argument, value),)
+                for argument, value in arguments.items()
+            ]
+            position_lists = [self._filter_positions(key) for key in filters]
+            limit = spec.get("limit")
+            limit = None if limit is None else int(limit)
+        except (TypeError, ValueError) as e:
+            return {"id": spec.get("id"), "error": str(e)}
+        if spec.get("now_next"):
+            if self._now_next is None:
+                self._now_next = self.fahrplan.time_index.now_and_next(self.now)
+            position_lists.append(self._now_next)
+        position_lists = sorted(
+            (positions for positions in position_lists if positions is not None), key=len
+        )
+        talks = self.fahrplan.flat_plans
+        if position_lists:
+            positions = set(position_lists[0])
+            for other_positions in position_lists[1:]:
+                positions.intersection_update(other_positions)
+            matching_talks = [talks[position] for position in sorted(positions)]
+        else:
+            matching_talks = talks
+        if spec.get("search") is not None:
+            accepted = {id(talk) for talk in matching_talks} if position_lists else None
+            matching_talks = self.fahrplan.search(
+                spec["search"], limit, None if accepted is None else lambda talk: id(talk) in accepted
+            )
+        else:
+            matching_talks = select_talks(
+                matching_talks, spec.get("sort"), bool(spec.get("reverse")), limit
+            )
+        return {"id": spec.get("id"), "talks": [talk.as_dict() for talk in matching_talks]}
+
+
+def batch_conferences(specs: list) -> list:
+    """
+    All conferences any of the specs can match
+    """
+    conferences = []
+    for spec in specs:
+        for conference in conferences_matching(str(spec.get("conference") or DEFAULT_CONFERENCE)):
+            if conference not in conferences:
+                conferences.append(conference)
+    return conferences
+
+
+_worker_evaluator = None
+
+
+def _init_worker(conferences: list, max_workers: int, now: dt.datetime) -> None:
+    global _worker_evaluator
+    from pyfahrplan.lib import Fahrplan
+
+    # the parent saved the snapshot already, so this neither downloads nor parses much
+    _worker_evaluator = BatchEvaluator(Fahrplan(max_workers=max_workers, conferences=conferences), now)
+
+
+def _evaluate_in_worker(spec: dict) -> dict:
+    return _worker_evaluator.evaluate(spec)
+
+
+def run_batch(specs: list, fahrplan=None, processes: int = 1, max_workers: int = None, now=None):
+    """
+    Yields one result per spec, in the order of the specs, see BatchEvaluator.evaluate
+
+    The fahrplans all specs need are loaded once, unless a loaded fahrplan is given. With more
+    than one process every process loads them from the snapshot and evaluates a share of the
+    specs, that only pays off for large batches.
+    """
+    from pyfahrplan.lib import Fahrplan
+
+    specs = list(specs)
+    now = dt.datetime.now().astimezone() if now is None else now
+    max_workers = cli_defaults["max_workers"] if max_workers is None else max_workers
+    if fahrplan is None:
+        fahrplan = Fahrplan(max_workers=max_workers, conferences=batch_conferences(specs))
+    else:
+        fahrplan.load(batch_conferences(specs))
+    if processes <= 1 or len(specs) < 2 * processes:
+        evaluator = BatchEvaluator(fahrplan, now)
+        for spec in specs:
+            yield evaluator.evaluate(spec)
+        return
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(fahrplan.conferences, max_workers, now),
+    ) as executor:
+        # big chunks, so every process can share its filters between many specs
+        yield from executor.map(
+            _evaluate_in_worker, specs, chunksize=max(1, len(specs) // (4 * processes))
+        )
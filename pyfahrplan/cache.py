@@ -0,0 +1,368 @@
+from contextlib import contextmanager
+from pathlib import Path
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from pyfahrplan.config import Colour, config_defaults as cli_defaults
+from pyfahrplan.snapshot import content_digest
+
+# a conference is finished once its last talk ended this long ago, its schedule won't change
+# any more (late room swaps and cancellations are published during the conference)
+FINISHED_AFTER = 24 * 60 * 60
+STAT_COUNTERS = ("hits", "revalidated", "downloads", "stale")
+# bump this whenever the tables change, an older cache is emptied then
+SCHEMA_VERSION = 2
+# caches that were reported as broken already, a broken cache is reported once per run
+_reported_caches = set()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    content BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    stored REAL NOT NULL,
+    used REAL NOT NULL,
+    immutable INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats (
+    url TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    revalidated INTEGER NOT NULL DEFAULT 0,
+    downloads INTEGER NOT NULL DEFAULT 0,
+    stale INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def conference_finished(columns: dict, now: float = None) -> bool:
+    """
+    Whether the last talk of the flattened schedule ended FINISHED_AFTER ago
+
+    A schedule without talks isn't finished, it is more likely not published yet.
+    """
+    now = time.time() if now is None else now
+    ends = [end for end in columns["end_epoch"] if end is not None]
+    return bool(ends) and max(ends) < now - FINISHED_AFTER
+
+
+class CacheEntry:
+    """
+    A schedule as served by ScheduleCache.fetch, its content is only decompressed when read
+    """
+
+    __slots__ = (
+        "url", "digest", "size", "etag", "last_modified", "stored", "immutable", "from_cache",
+        "_compressed", "_content",
+    )
+
+    def __init__(
+        self, url, digest, size, etag, last_modified, stored, immutable, compressed=None, content=None
+    ):
+        self.url = url
+        # content_digest of the schedule, the snapshot key depends on the flatten version too
+        self.digest = digest
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored = stored
+        self.immutable = bool(immutable)
+        self.from_cache = content is None
+        self._compressed = compressed
+        self._content = content
+
+    def read(self) -> bytes:
+        if self._content is None:
+            self._content = zlib.decompress(self._compressed)
+            self._compressed = None
+        return self._content
+
+    @property
+    def validators(self) -> dict:
+        return {"ETag": self.etag, "Last-Modified": self.last_modified}
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def is_fresh(self, ttl: float, now: float) -> bool:
+        return self.immutable or now - self.stored < ttl
+
+
+class _UnusableDatabase:
+    """
+    Stands in for the connection of a cache that can't be opened
+    """
+
+    def __init__(self, error: sqlite3.Error):
+        self.error = error
+
+    def execute(self, *args):
+        raise self.error
+
+
+class ScheduleCache:
+    """
+    Http cache of the schedules, one zlib compressed sqlite row per url
+
+    Schedules of finished conferences are immutable and never revalidated. The others are fresh
+    for ttl seconds and revalidated with ETag/Last-Modified afterwards. Once the compressed
+    entries take more than max_size bytes, the least recently used ones are evicted. Hits,
+    revalidations and downloads are counted per url, they survive the eviction of the entry.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: float = cli_defaults["cache_ttl"],
+        max_size: int = cli_defaults["cache_size"],
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        # one connection shared by the download threads, sqlite3 objects aren't thread safe
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _open(self) -> sqlite3.Connection:
+        # autocommit, every statement is its own transaction
+        connection = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                connection.executescript("DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS stats;")
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.executescript(_SCHEMA)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            try:
+                self._connection = self._open()
+            except sqlite3.OperationalError:
+                # locked or not writable, a new file wouldn't help
+                raise
+            except sqlite3.DatabaseError as e:
+                # not a database (any more), it is only a cache, so it is started over
+                self._report(e, "is broken, starting a new one")
+                for suffix in ("", "-wal", "-shm"):
+                    Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+                self._connection = self._open()
+        return self._connection
+
+    @contextmanager
+    def _database(self):
+        """
+        The connection, with the lock held. sqlite errors are reported and swallowed, the
+        statements of the block are skipped then and fetch() downloads without the cache.
+        """
+        with self._lock:
+            try:
+                connection = self._connect()
+            except sqlite3.Error as e:
+                # a contextmanager can't skip its block, the first statement raises instead
+                connection = _UnusableDatabase(e)
+            try:
+                yield connection
+            except sqlite3.Error as e:
+                self._report(e, "can't be used, downloading without it")
+
+    def _report(self, error: Exception, consequence: str) -> None:
+        if (self.path, consequence) in _reported_caches:
+            return
+        _reported_caches.add((self.path, consequence))
+        print(f"{Colour.WARNING}The fahrplan cache {self.path} {consequence}.{Colour.ENDC}", file=sys.stderr)
+        print(error, file=sys.stderr)
+
+    def forget(self, url: str, error: Exception = None) -> None:
+        """
+        Removes the entry of url, e.g. because its content can't be decompressed (error)
+        """
+        if error is not None:
+            self._report(error, "has a broken entry, downloading it again")
+        with self._database() as connection:
+            connection.execute("DELETE FROM entries WHERE url = ?", (url,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def get(self, url: str):
+        """
+        The cached entry of url or None, no matter whether it is fresh
+        """
+        row = None
+        with self._database() as connection:
+            row = connection.execute(
+                "SELECT digest, size, etag, last_modified, stored, immutable, content"
+                " FROM entries WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        digest, size, etag, last_modified, stored, immutable, compressed = row
+        return CacheEntry(url, digest, size, etag, last_modified, stored, immutable, compressed=compressed)
+
+    def fetch(self, session, url: str, now: float = None) -> CacheEntry:
+        """
+        url from the cache if its entry is fresh, else revalidated or downloaded with session
+
+        An outdated entry is still returned when the server can't be reached.
+        """
+        import requests
+
+        now = time.time() if now is None else now
+        entry = self.get(url)
+        if entry is not None and entry.is_fresh(self.ttl, now):
+            self._touch(url, "hits", now)
+            return entry
+        try:
+            response = session.get(url, headers={} if entry is None else entry.conditional_headers())
+            if entry is not None and response.status_code == 304:
+                self.revalidated(url, now)
+                entry.stored = now
+                return entry
+            response.raise_for_status()
+        except requests.RequestException:
+            if entry is None:
+                raise
+            self._touch(url, "stale", now)
+            return entry
+        return self.store(url, response, now)
+
+    def store(self, url: str, response, now: float = None) -> CacheEntry:
+        """
+        Caches a downloaded schedule (not immutable yet) and evicts what exceeds max_size
+        """
+        now = time.time() if now is None else now
+        content = response.content
+        compressed = zlib.compress(content)
+        entry = CacheEntry(
+            url,
+            content_digest(content),
+            len(content),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            now,
+            False,
+            content=content,
+        )
+        with self._database() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries"
+                " (url, content, size, stored_size, digest, etag, last_modified, stored, used, immutable)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (url, compressed, entry.size, len(compressed), entry.digest, entry.etag,
+                 entry.last_modified, now, now),
+            )
+            self._count(connection, url, "downloads")
+        self.evict()
+        return entry
+
+    def revalidated(self, url: str, now: float = None) -> None:
+        """
+        The server answered 304 for url, its entry is fresh again
+        """
+        now = time.time() if now is None else now
+        with self._database() as connection:
+            connection.execute("UPDATE entries SET stored = ?, used = ? WHERE url = ?", (now, now, url))
+            self._count(connection, url, "revalidated")
+
+    def mark_immutable(self, url: str) -> None:
+        with self._database() as connection:
+            connection.execute("UPDATE entries SET immutable = 1 WHERE url = ?", (url,))
+
+    def is_immutable(self, url: str) -> bool:
+        row = None
+        with self._database() as connection:
+            row = connection.execute(
+                "SELECT immutable FROM entries WHERE url = ?", (url,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def _touch(self, url: str, counter: str, now: float) -> None:
+        with self._database() as connection:
+            connection.execute("UPDATE entries SET used = ? WHERE url = ?", (now, url))
+            self._count(connection, url, counter)
+
+    @staticmethod
+    def _count(connection: sqlite3.Connection, url: str, counter: str) -> None:
+        # counter is one of STAT_COUNTERS, never user input
+        connection.execute(
+            f"INSERT INTO stats (url, {counter}) VALUES (?, 1)"
+            f" ON CONFLICT(url) DO UPDATE SET {counter} = {counter} + 1",
+            (url,),
+        )
+
+    def evict(self, max_size: int = None) -> list:
+        """
+        Removes the least recently used entries until the rest fit into max_size bytes
+
+        Returns the urls of the removed entries.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        removed = []
+        with self._database() as connection:
+            total = connection.execute("SELECT COALESCE(SUM(stored_size), 0) FROM entries").fetchone()[0]
+            if total <= max_size:
+                return removed
+            for url, stored_size in connection.execute(
+                "SELECT url, stored_size FROM entries ORDER BY used"
+            ).fetchall():
+                if total <= max_size:
+                    break
+                connection.execute("DELETE FROM entries WHERE url = ?", (url,))
+                total -= stored_size
+                removed.append(url)
+        return removed
+
+    def stats(self, now: float = None) -> list:
+        """
+        One dict per url that was ever cached: sizes, policy, counters and hit rate
+
+        The hit rate counts hits and revalidations (no download needed) of all requests. Unlike
+        the other methods this raises the sqlite3.Error of a cache that can't be used.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT stats.url, entries.size, entries.stored_size, entries.stored,"
+                " entries.used, entries.immutable, hits, revalidated, downloads, stale"
+                " FROM stats LEFT JOIN entries ON entries.url = stats.url ORDER BY stats.url"
+            ).fetchall()
+        stats = []
+        for url, size, stored_size, stored, used, immutable, *counters in rows:
+            url_stats = {
+                "url": url,
+                "cached": size is not None,
+                "size": size or 0,
+                "stored_size": stored_size or 0,
+                "immutable": bool(immutable),
+                "expires_in": None if immutable or stored is None else stored + self.ttl - now,
+                "last_used": used,
+            }
+            url_stats.update(zip(STAT_COUNTERS, counters))
+            total = sum(counters)
+            url_stats["hit_rate"] = (
+                (url_stats["hits"] + url_stats["revalidated"]) / total if total else 0.0
+            )
+            stats.append(url_stats)
+        return stats
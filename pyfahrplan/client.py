@@ -0,0 +1,25 @@
+import json
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from pyfahrplan.config import config_defaults as cli_defaults
+
+
+def query_server(
+    parameters: dict,
+    host: str = cli_defaults["server_host"],
+    port: int = cli_defaults["server_port"],
+    timeout: float = 0.5,
+):
+    """
+    Asks a running server for talks, returns None if no server is running
+
+    parameters are the query parameters of /talks, None values are left out.
+    """
+    query_string = urlencode({key: value for key, value in parameters.items() if value is not None})
+    try:
+        with urlopen(f"http://{host}:{port}/talks?{query_string}", timeout=timeout) as response:
+            return json.load(response)["talks"]
+    except (URLError, OSError, ValueError, KeyError):
+        return None
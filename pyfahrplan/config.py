@@ -1,5 +1,6 @@
 config_defaults = {
     "speaker": None,
+    "speaker_match": "substring",  # or "exact" / "prefix", matched against each person's name
     "title": None,
     "track": None,
     "day": -1,  # 0 seems to be a valid day value in some c3s
@@ -11,9 +12,60 @@ config_defaults = {
     "sort": None,
     "tablefmt": "fancy_grid",
     "update_cache": False,
-    "no_past": False
+    "no_past": False,
+    "max_workers": 8,
+    "search": None,
+    "search_limit": 20,
+    "format": "table",
+    "limit": None,
+    "server_host": "127.0.0.1",
+    "server_port": 8765,
+    "refresh_interval": 15 * 60,  # seconds
+    "cache_ttl": 5 * 60,  # seconds until the cached fahrplan of a running conference is revalidated
+    "cache_size": 64 * 1024 * 1024,  # bytes of compressed fahrplans, the least recently used are evicted
 }
 
+# the built in conference acronym -> schedule url, the acronyms have to match the acronyms in
+# the schedules. More can be added with pyfahrplan.sources.
+conferences = {
+    f"{x}c3": f"https://raw.githubusercontent.com/voc/{x}C3_schedule/master/everything.schedule.json"
+    for x in range(32, 37)
+}
+# voc urls for the remote c3 schedules
+conferences.update({
+    "rc3": "https://data.c3voc.de/rC3/everything.schedule.json",
+    "rc3-2021": "https://data.c3voc.de/rC3_21/everything.schedule.json",
+})
+
+# how a speaker filter can be matched, see config_defaults["speaker_match"]
+speaker_matches = ("substring", "exact", "prefix")
+
+
+def check_speaker_match(speaker_match: str) -> str:
+    """
+    speaker_match if it is one of speaker_matches, else ValueError
+    """
+    if speaker_match not in speaker_matches:
+        raise ValueError(
+            f"speaker_match has to be one of {', '.join(speaker_matches)}, not {speaker_match!r}"
+        )
+    return speaker_match
+
+
+def conferences_matching(conference: str, acronyms: list = None) -> list:
+    """
+    Acronyms of all conferences that the conference filter of filter_talk can match
+
+    acronyms defaults to all conferences of the source registry, see pyfahrplan.sources.
+    """
+    if acronyms is None:
+        from pyfahrplan.sources import load_sources
+
+        acronyms = list(load_sources())
+    if conference == config_defaults["conference"]:
+        return list(acronyms)
+    return [acronym for acronym in acronyms if conference.lower() in acronym.lower()]
+
 
 class Colour:
     HEADER = "\033[95m"
@@ -0,0 +1,302 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import datetime as dt
+from functools import lru_cache
+import heapq
+from operator import itemgetter
+import re
+
+from pyfahrplan.talk import parse_clock
+
+# a name is also found by its parts, "Müller-Lüdenscheidt" by "Müller" too
+NAME_PARTS_RE = re.compile(r"[\s\-]+")
+
+
+def _timed_positions(talks: list) -> list:
+    return [i for i, talk in enumerate(talks) if talk.start_epoch is not None]
+
+
+class TimeIndex:
+    """
+    Sorted start and end times of a list of talks
+
+    Every lookup returns positions in the indexed list, in ascending order, so results keep the
+    order of the talks. Talks without times are never found.
+    """
+
+    def __init__(self, talks: list):
+        self.talks = talks
+        timed = _timed_positions(talks)
+        # minute of the day, the clock time based --start filter ignores the date
+        self._by_start_minute = sorted(timed, key=lambda i: talks[i].start_minute)
+        self._start_minutes = [talks[i].start_minute for i in self._by_start_minute]
+        self._max_duration = max((talks[i].duration_minutes for i in timed), default=0)
+        self._by_start = sorted(timed, key=lambda i: talks[i].start_epoch)
+        self._starts = [talks[i].start_epoch for i in self._by_start]
+        self._by_end = sorted(timed, key=lambda i: talks[i].end_epoch)
+        self._ends = [talks[i].end_epoch for i in self._by_end]
+
+    def in_timerange(self, start: str) -> list:
+        """
+        Same talks as is_talk_in_timerange: running at start or starting within the hour of start
+        """
+        minute = parse_clock(start)
+        hour_begin = minute - minute % 60
+        positions = set(
+            self._by_start_minute[
+                bisect_left(self._start_minutes, hour_begin):
+                bisect_right(self._start_minutes, hour_begin + 59)
+            ]
+        )
+        # a running talk started at most the longest duration before start
+        for i in self._by_start_minute[
+            bisect_left(self._start_minutes, minute - self._max_duration):
+            bisect_right(self._start_minutes, minute)
+        ]:
+            talk = self.talks[i]
+            if minute <= talk.start_minute + talk.duration_minutes:
+                positions.add(i)
+        return sorted(positions)
+
+    def not_past(self, now: dt.datetime) -> list:
+        """
+        Talks that did not end before now, like the --no-past filter of Query
+        """
+        return sorted(self._by_end[bisect_left(self._ends, now.timestamp()):])
+
+    def now_and_next(self, now: dt.datetime) -> list:
+        """
+        Per conference and room the talks running at now plus the next talk starting after now
+        """
+        timestamp = now.timestamp()
+        positions = set()
+        for i in self._by_start[
+            bisect_left(self._starts, timestamp - self._max_duration * 60):
+            bisect_right(self._starts, timestamp)
+        ]:
+            if timestamp <= self.talks[i].end_epoch:
+                positions.add(i)
+        rooms = {(self.talks[i].conference_acronym, self.talks[i].room) for i in self._by_start}
+        rooms_with_next = set()
+        for i in self._by_start[bisect_right(self._starts, timestamp):]:
+            if len(rooms_with_next) == len(rooms):
+                break
+            room = (self.talks[i].conference_acronym, self.talks[i].room)
+            if room not in rooms_with_next:
+                rooms_with_next.add(room)
+                positions.add(i)
+        return sorted(positions)
+
+
+class IntervalIndex:
+    """
+    Static interval tree over the [start_epoch, end_epoch) of a list of talks
+
+    The talks are sorted by start, the middle of every range is the root of that range and
+    knows the latest end below it, so a lookup skips every subtree that ends too early:
+    O(log n + k) per lookup, O(n log n) to build. Talks overlap if one starts before the other
+    ends, a talk ending at 12:00 does not overlap one starting at 12:00. Talks without times
+    overlap nothing.
+    """
+
+    def __init__(self, talks: list):
+        self.talks = talks
+        self._by_start = sorted(_timed_positions(talks), key=lambda i: (talks[i].start_epoch, i))
+        self._starts = [talks[i].start_epoch for i in self._by_start]
+        self._ends = [talks[i].end_epoch for i in self._by_start]
+        self._max_ends = list(self._ends)
+        self._build(0, len(self._by_start))
+
+    def _build(self, low: int, high: int) -> float:
+        if low >= high:
+            return float("-inf")
+        middle = (low + high) // 2
+        self._max_ends[middle] = max(
+            self._ends[middle], self._build(low, middle), self._build(middle + 1, high)
+        )
+        return self._max_ends[middle]
+
+    def overlapping(self, start: float, end: float) -> list:
+        """
+        Positions of the talks running at some point in [start, end)
+        """
+        positions = []
+        ranges = [(0, len(self._by_start))]
+        while ranges:
+            low, high = ranges.pop()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            if self._max_ends[middle] <= start:
+                continue
+            # the right subtree starts even later than the middle talk
+            if self._starts[middle] < end:
+                if self._ends[middle] > start:
+                    positions.append(self._by_start[middle])
+                ranges.append((middle + 1, high))
+            ranges.append((low, middle))
+        return sorted(positions)
+
+    def parallel_to(self, position: int) -> list:
+        """
+        Positions of the other talks that run at the same time as the talk at position
+        """
+        talk = self.talks[position]
+        if talk.start_epoch is None:
+            return []
+        return [i for i in self.overlapping(talk.start_epoch, talk.end_epoch) if i != position]
+
+    def room_conflicts(self) -> list:
+        """
+        (position, position) of every two talks that overlap in the same room of a conference
+
+        One sweep over the talks by start, per room only the talks that did not end yet are kept.
+        """
+        conflicts = []
+        running = defaultdict(list)  # (conference, room) -> heap of (end, position)
+        for position in self._by_start:
+            talk = self.talks[position]
+            room = running[(talk.conference_acronym, talk.room)]
+            while room and room[0][0] <= talk.start_epoch:
+                heapq.heappop(room)
+            conflicts.extend((other, position) for _, other in sorted(room, key=itemgetter(1)))
+            heapq.heappush(room, (talk.end_epoch, position))
+        return conflicts
+
+
+class SubstringIndex:
+    """
+    Trigram postings over the lowercased values of one talk field
+
+    search() returns the same talks as `needle.lower() in talk[field].lower()`, the trigrams only
+    pick the candidates that are verified with exactly that check.
+    """
+
+    def __init__(self, talks: list, field: str):
+        self.size = len(talks)
+        # talks share values (rooms, tracks), so everything is indexed per distinct value
+        value_ids = {}
+        self._values = []
+        self._positions = []
+        for position, talk in enumerate(talks):
+            value = talk[field].lower()
+            if value not in value_ids:
+                value_ids[value] = len(self._values)
+                self._values.append(value)
+                self._positions.append([])
+            self._positions[value_ids[value]].append(position)
+        self._trigrams = defaultdict(set)
+        for value_id, value in enumerate(self._values):
+            for i in range(len(value) - 2):
+                self._trigrams[value[i:i + 3]].add(value_id)
+
+    def search(self, needle: str) -> list:
+        needle = needle.lower()
+        if len(needle) < 3:
+            value_ids = range(len(self._values))
+        else:
+            postings = sorted(
+                (self._trigrams.get(needle[i:i + 3], set()) for i in range(len(needle) - 2)),
+                key=len,
+            )
+            value_ids = set.intersection(*postings)
+        positions = []
+        for value_id in value_ids:
+            if needle in self._values[value_id]:
+                positions.extend(self._positions[value_id])
+        return sorted(positions)
+
+
+def normalise_name(name: str) -> str:
+    from pyfahrplan.search import normalise
+
+    return " ".join(normalise(name).split())
+
+
+@lru_cache(maxsize=65536)
+def name_variants(name: str) -> frozenset:
+    """
+    Normalised forms a name can be found by: the whole name and every part of it, each with
+    umlauts folded (ü -> ue) and with accents stripped (ü -> u)
+    """
+    from pyfahrplan.search import strip_accents
+
+    variants = set()
+    for folded in (normalise_name(name), " ".join(strip_accents(name.casefold()).split())):
+        if folded:
+            variants.add(folded)
+            variants.update(part for part in NAME_PARTS_RE.split(folded) if part)
+    return frozenset(variants)
+
+
+def name_matches(needle: str, name: str, prefix: bool = False) -> bool:
+    """
+    Whether the normalised needle finds name, the same check PersonIndex.find does per person
+    """
+    if prefix:
+        return any(variant.startswith(needle) for variant in name_variants(name))
+    return needle in name_variants(name)
+
+
+class PersonIndex:
+    """
+    Talks per person, keyed by the person keys of Talk.persons, plus a lookup by name
+
+    A name is found by its full name or any part of it, exactly or as a prefix, so "ann" finds
+    "Ann Smith" but not "Joanna".
+    """
+
+    def __init__(self, talks: list):
+        # person key -> positions of their talks, in ascending order
+        self._positions = defaultdict(list)
+        # person key -> name, the last name a person used wins
+        self.names = {}
+        variant_keys = defaultdict(set)
+        for position, talk in enumerate(talks):
+            for key, name in talk.persons:
+                positions = self._positions[key]
+                # a person can be listed twice for one talk
+                if not positions or positions[-1] != position:
+                    positions.append(position)
+                if self.names.get(key) != name:
+                    self.names[key] = name
+                    for variant in name_variants(name):
+                        variant_keys[variant].add(key)
+        self._variants = sorted(variant_keys)
+        self._variant_keys = [variant_keys[variant] for variant in self._variants]
+
+    def __len__(self):
+        return len(self._positions)
+
+    def talks_of(self, key: str) -> list:
+        """
+        Positions of all talks of one person
+        """
+        return self._positions.get(key, [])
+
+    def find(self, name: str, prefix: bool = False) -> list:
+        """
+        Keys of the persons found by name, sorted
+        """
+        name = normalise_name(name)
+        if not name:
+            return []
+        begin = bisect_left(self._variants, name)
+        if prefix:
+            # every variant starting with name sorts between name and name + the last code point
+            end = bisect_left(self._variants, name + "\U0010ffff")
+        else:
+            end = begin + (begin < len(self._variants) and self._variants[begin] == name)
+        keys = set()
+        for variant_keys in self._variant_keys[begin:end]:
+            keys.update(variant_keys)
+        return sorted(keys)
+
+    def positions(self, name: str, prefix: bool = False) -> list:
+        """
+        Positions of the talks of every person found by name
+        """
+        positions = set()
+        for key in self.find(name, prefix):
+            positions.update(self._positions[key])
+        return sorted(positions)
@@ -1,109 +1,1023 @@
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import csv
 import datetime as dt
-from dateutil.parser import parse
+import heapq
+from itertools import islice
+import json
 from json.decoder import JSONDecodeError
+from operator import itemgetter
 import os
 from pathlib import Path
 import sys
+import threading
+import time
+from urllib.parse import urlparse
+import zlib
 
-import requests
-import requests_cache
-from rich.console import Console
-from rich.table import Table
-
-from pyfahrplan.config import config_defaults as cli_defaults, Colour
+from pyfahrplan.cache import STAT_COUNTERS, ScheduleCache, conference_finished
+from pyfahrplan.config import check_speaker_match, config_defaults as cli_defaults, Colour
+from pyfahrplan.index import (
+    IntervalIndex,
+    PersonIndex,
+    SubstringIndex,
+    TimeIndex,
+    name_matches,
+    normalise_name,
+)
+from pyfahrplan.search import build_search_index, search as search_indexes
+from pyfahrplan.snapshot import (
+    columns_to_talks,
+    digest_snapshot_key,
+    empty_snapshot,
+    load_search_indexes,
+    load_snapshot,
+    save_search_indexes,
+    save_snapshot,
+    snapshot_key,
+    talks_to_columns,
+)
+from pyfahrplan.sources import decode_schedule, is_local, load_sources, read_local
+from pyfahrplan.stream import iter_schedule_days
+from pyfahrplan.talk import Talk, intern_value, parse_clock, person_key, person_name, talk_times
+from pyfahrplan.timings import current as current_timings
 
 script_dir = Path(os.path.dirname(os.path.realpath(__file__)))
-cache_file = Path("fahrplan_cache")
-requests_cache.install_cache(str(script_dir / cache_file))
+cache_file = Path("schedule_cache.sqlite")
+snapshot_file = Path("fahrplan_snapshot.pickle")
+search_file = Path("fahrplan_search.pickle")
+
+
+def new_session() -> "requests.Session":
+    """
+    A requests session, caching is up to ScheduleCache
+
+    requests and rich are only imported where they are used, so that --help or a query answered
+    by the server don't pay for them.
+    """
+    import requests
+
+    return requests.Session()
+
+
+def new_cache(use_cache: bool = True):
+    """
+    The ScheduleCache next to the package, or None if use_cache is False
+    """
+    return ScheduleCache(script_dir / cache_file) if use_cache else None
 
 
 class Fahrplan:
-    def __init__(self, update_cache: bool = cli_defaults['update_cache']):
-        self.urls = [
-            f"https://raw.githubusercontent.com/voc/{x}C3_schedule/master/everything.schedule.json"
-            for x in range(32, 37)
-        ]
-        # voc urls for the remote c3 schedules
-        self.urls.extend([
-            "https://data.c3voc.de/rC3/everything.schedule.json",
-            "https://data.c3voc.de/rC3_21/everything.schedule.json"
-        ])
+    def __init__(
+        self,
+        update_cache: bool = cli_defaults['update_cache'],
+        max_workers: int = cli_defaults['max_workers'],
+        use_snapshot: bool = True,
+        conferences: list = None,
+        use_indexes: bool = False,
+        use_cache: bool = True,
+        sources: dict = None,
+    ):
+        # acronym -> url or local path of every known conference (default: the source
+        # registry), only self.conferences are loaded
+        self.sources = load_sources() if sources is None else dict(sources)
+        self.conferences = []
+        self.urls = []
+        # only the schedules that were not found in the snapshot when loading are parsed into
+        # self.fahrplans, refreshes don't add to it
         self.fahrplans = []
         self.flat_plans = []
         self.update_cache = update_cache
-        self._get_fahrplans()
-        self.flatten_fahrplans()
-
-    def _get_fahrplans(self):
+        self.max_workers = max(1, max_workers)
+        self.use_snapshot = use_snapshot
+        self.snapshot_path = script_dir / snapshot_file
+        self.search_path = script_dir / search_file
+        self.cache = new_cache(use_cache)
+        self._snapshot = None
+        # snapshot key -> full text index, only loaded by the first search
+        self._search = None
+        # url -> flattened talk columns of every loaded schedule
+        self._flat_schedules = {}
+        # url -> snapshot key and url -> position of its first talk in self.flat_plans
+        self._snapshot_keys = {}
+        self._offsets = {}
+        # url -> ETag and Last-Modified of the last response, for conditional refreshes
+        self._validators = {}
+        # building the substring indexes costs more than one linear scan, so they are only worth
+        # it for long running processes that answer many queries
+        self.use_indexes = use_indexes
+        self._time_index = None
+        self._interval_index = None
+        self._person_index = None
+        self._substring_indexes = {}
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        # what the last refresh() changed
+        self.changes = []
+        self.load(self.sources if conferences is None else conferences)
+        # no conference matching (e.g. -c 37c3) is an empty result, not a broken download
+        if self.urls and not self._flat_schedules:
+            print(
+                f"{Colour.FAIL}Fahrplan empty. Something is wrong with your urls. Exiting.{Colour.ENDC}",  # noqa: E501
+                file=sys.stderr,
+            )
+            sys.exit()
         if self.update_cache:
-            requests_cache.clear()
-        self.fahrplans = []
-        for url in self.urls:
-            try:
-                self.fahrplans.append(requests.get(url).json()["schedule"])
-            except JSONDecodeError as e:
+            self.refresh()
+
+    def load(self, conferences: list) -> None:
+        """
+        Loads the given conferences unless they are loaded already
+        """
+        new_conferences = []
+        for conference in conferences:
+            if conference not in self.sources:
                 print(
-                    f"{Colour.FAIL}Problem downloading the Fahrplan {url}. Check your internet connection.{Colour.ENDC}"  # noqa: E501
+                    f"{Colour.WARNING}Unknown conference {conference}, skipping it.{Colour.ENDC}",
+                    file=sys.stderr,
                 )
-                print(e)
-        if not self.fahrplans:
+            elif conference not in self.conferences and conference not in new_conferences:
+                new_conferences.append(conference)
+        if not new_conferences:
+            return
+        self.conferences.extend(new_conferences)
+        urls = [self.sources[conference] for conference in new_conferences]
+        self.urls.extend(urls)
+        self._get_fahrplans(urls)
+        self.flatten_fahrplans()
+
+    def _session_for(self, url: str) -> "requests.Session":
+        """
+        One pooled session per host, so all schedules of a host share their connections
+        """
+        from requests.adapters import HTTPAdapter
+
+        host = urlparse(url).netloc
+        with self._sessions_lock:
+            if host not in self._sessions:
+                session = new_session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def _get_fahrplan(self, url: str, snapshot: dict) -> tuple:
+        """
+        Downloads one schedule, it is only parsed and flattened if the snapshot doesn't know it yet
+
+        Returns (snapshot key, parsed schedule or None, flattened talk columns, schedule version)
+        """
+        begin = time.perf_counter()
+        if is_local(url):
+            with read_local(url) as content:
+                return self._read_fahrplan(url, content, snapshot, False, time.perf_counter() - begin)
+        if self.cache is None:
+            response = self._session_for(url).get(url)
+            response.raise_for_status()
+            self._validators[url] = _validators(response)
+            return self._read_fahrplan(
+                url, response.content, snapshot, False, time.perf_counter() - begin
+            )
+        try:
+            return self._get_cached_fahrplan(url, snapshot, begin)
+        except zlib.error as e:
+            # a broken entry, it is downloaded again
+            self.cache.forget(url, e)
+            return self._get_cached_fahrplan(url, snapshot, begin)
+
+    def _get_cached_fahrplan(self, url: str, snapshot: dict, begin: float) -> tuple:
+        entry = self.cache.fetch(self._session_for(url), url)
+        self._validators[url] = entry.validators
+        key, schedule, columns, version = self._read_fahrplan(
+            url, entry.read, snapshot, entry.from_cache, time.perf_counter() - begin,
+            key=digest_snapshot_key(entry.digest), size=entry.size,
+        )
+        if not entry.immutable and conference_finished(columns):
+            self.cache.mark_immutable(url)
+        return key, schedule, columns, version
+
+    def _read_fahrplan(
+        self, url: str, content, snapshot: dict, from_cache: bool, seconds: float,
+        key: str = None, size: int = None,
+    ) -> tuple:
+        """
+        Flattens content (bytes or the memory map of a local file) unless the snapshot has it
+
+        A cached schedule passes its key and size, its content is the function that
+        decompresses it, so a schedule that the snapshot knows is never decompressed.
+        """
+        timings = current_timings()
+        key = snapshot_key(content) if key is None else key
+        in_snapshot = key in snapshot["schedules"]
+        if timings.enabled:
+            timings.add("download", seconds)
+            timings.url(url, from_cache, in_snapshot, len(content) if size is None else size, seconds)
+        if in_snapshot:
+            return key, None, snapshot["schedules"][key], snapshot["versions"].get(key)
+        if callable(content):
+            content = content()
+        with timings.stage("decode"):
+            schedule = decode_schedule(content)["schedule"]
+        with timings.stage("flatten") as stage:
+            columns = talks_to_columns(flatten_fahrplan(schedule))
+            stage.talks = len(columns["title"])
+        return key, schedule, columns, schedule.get("version")
+
+    def _get_fahrplans(self, urls: list):
+        import requests
+
+        timings = current_timings()
+        if self._snapshot is None:
+            with timings.stage("snapshot_load"):
+                self._snapshot = load_snapshot(self.snapshot_path) if self.use_snapshot else empty_snapshot()
+        snapshot = self._snapshot
+        snapshot_changed = False
+        # the per url stages above are summed over the threads, this is the wall time of all of them
+        with timings.stage("get_fahrplans"), ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._get_fahrplan, url, snapshot) for url in urls]
+            # keep the order of the urls, a failing url must not abort the others
+            for url, future in zip(urls, futures):
+                try:
+                    key, schedule, columns, version = future.result()
+                except (
+                    JSONDecodeError, KeyError, UnicodeDecodeError, OSError, requests.RequestException
+                ) as e:
+                    print(
+                        f"{Colour.FAIL}Problem downloading the Fahrplan {url}. Check your internet connection.{Colour.ENDC}",  # noqa: E501
+                        file=sys.stderr,
+                    )
+                    print(e, file=sys.stderr)
+                    continue
+                if schedule is not None:
+                    self.fahrplans.append(schedule)
+                snapshot_changed |= self._set_schedule(url, key, columns, version)
+        if snapshot_changed:
+            self._save_snapshot()
+
+    def _set_schedule(self, url: str, key: str, columns: dict, version) -> bool:
+        """
+        Remembers the flattened schedule of url, returns whether the snapshot changed
+        """
+        self._flat_schedules[url] = columns
+        self._snapshot_keys[url] = key
+        snapshot = self._snapshot
+        if snapshot["sources"].get(url) == key:
+            return False
+        snapshot["sources"][url] = key
+        snapshot["schedules"][key] = columns
+        snapshot["versions"][key] = version
+        return True
+
+    def _fetch_update(self, url: str):
+        """
+        Asks the server whether the schedule changed, past the cache and with ETag/Last-Modified
+
+        Returns None if it didn't, else (snapshot key, schedule, flattened talk columns). The
+        schedules of finished conferences are immutable, they are never asked for.
+        """
+        if is_local(url):
+            # hashing a mapped file is cheap enough to not need any validators
+            with read_local(url) as content:
+                key = snapshot_key(content)
+                if key == self._snapshot_keys.get(url):
+                    return None
+                schedule = decode_schedule(content)["schedule"]
+            return key, schedule, talks_to_columns(flatten_fahrplan(schedule))
+        if self.cache is not None and self.cache.is_immutable(url):
+            return None
+        session = self._session_for(url)
+        headers = {}
+        validators = self._validators.get(url, {})
+        if validators.get("ETag"):
+            headers["If-None-Match"] = validators["ETag"]
+        if validators.get("Last-Modified"):
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+        response = session.get(url, headers=headers)
+        if response.status_code == 304:
+            if self.cache is not None:
+                self.cache.revalidated(url)
+            return None
+        response.raise_for_status()
+        self._validators[url] = _validators(response)
+        if self.cache is not None:
+            # so the next run starts from the new schedule
+            self.cache.store(url, response)
+        key = snapshot_key(response.content)
+        if key == self._snapshot_keys.get(url):
+            return None
+        schedule = json.loads(response.content)["schedule"]
+        return key, schedule, talks_to_columns(flatten_fahrplan(schedule))
+
+    def fetch_updates(self) -> dict:
+        """
+        Downloads the schedules that changed since they were loaded, {url: update}
+
+        Nothing is changed yet, apply_updates() does that. So a server can keep answering queries
+        while the updates are downloaded.
+        """
+        import requests
+
+        updates = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._fetch_update, url) for url in self.urls]
+            for url, future in zip(self.urls, futures):
+                try:
+                    update = future.result()
+                # OSError: a local schedule that can't be read
+                except (
+                    JSONDecodeError, KeyError, UnicodeDecodeError, OSError, requests.RequestException
+                ) as e:
+                    print(
+                        f"{Colour.FAIL}Problem updating the Fahrplan {url}. Check your internet connection.{Colour.ENDC}",  # noqa: E501
+                        file=sys.stderr,
+                    )
+                    print(e, file=sys.stderr)
+                    continue
+                if update is not None:
+                    updates[url] = update
+        return updates
+
+    def prepare_updates(self, updates: dict) -> "PreparedUpdates":
+        """
+        Builds the patched talks and indexes for updates without changing anything yet
+
+        Talks that did not change keep their Talk objects, schedules that did not change keep
+        their talks and their full text index. The indexes that are built already are built
+        again for the patched talks, so swap_updates() only has to assign them. A server can
+        keep answering queries meanwhile.
+        """
+        prepared = PreparedUpdates()
+        talks_by_url = {url: self._talks_of(url) for url in self.urls if url in self._offsets}
+        for url, (key, schedule, columns) in updates.items():
+            old_talks = talks_by_url.get(url, [])
+            new_talks = columns_to_talks(columns)
+            matches = _match_talks(old_talks, new_talks)
+            schedule_changes = diff_talks(old_talks, new_talks, matches)
+            schedule_changes.conference = schedule["conference"]["acronym"]
+            schedule_changes.old_version = self._snapshot["versions"].get(self._snapshot_keys.get(url))
+            schedule_changes.new_version = schedule.get("version")
+            prepared.changes.append(schedule_changes)
+            talks_by_url[url] = [
+                old if old is not None and old == new else new
+                for old, new in matches
+                if new is not None
+            ]
+            # the decoded schedule isn't kept, a long running server would pile them up
+            prepared.schedules[url] = (key, columns, schedule.get("version"))
+            if self._search is not None:
+                prepared.search[key] = build_search_index(talks_by_url[url])
+        if not updates:
+            return prepared
+        prepared.flat_plans = []
+        for url in self.urls:
+            if url in talks_by_url:
+                prepared.offsets[url] = len(prepared.flat_plans)
+                prepared.flat_plans.extend(talks_by_url[url])
+        talks = prepared.flat_plans
+        prepared.time_index = None if self._time_index is None else TimeIndex(talks)
+        prepared.interval_index = None if self._interval_index is None else IntervalIndex(talks)
+        prepared.person_index = None if self._person_index is None else PersonIndex(talks)
+        prepared.substring_indexes = {
+            field: SubstringIndex(talks, field) for field in self._substring_indexes
+        }
+        return prepared
+
+    def swap_updates(self, prepared: "PreparedUpdates") -> list:
+        """
+        Switches to the talks and indexes of prepare_updates(), returns its ScheduleChanges
+
+        Only assigns attributes, the snapshot is written by save_updates().
+        """
+        for url, (key, columns, version) in prepared.schedules.items():
+            self._set_schedule(url, key, columns, version)
+        if prepared.flat_plans is not None:
+            self.flat_plans = prepared.flat_plans
+            self._offsets = prepared.offsets
+            self._time_index = prepared.time_index
+            self._interval_index = prepared.interval_index
+            self._person_index = prepared.person_index
+            self._substring_indexes = prepared.substring_indexes
+        if self._search is not None:
+            self._search.update(prepared.search)
+        self.changes = prepared.changes
+        return prepared.changes
+
+    def save_updates(self, prepared: "PreparedUpdates") -> None:
+        if prepared.schedules:
+            self._save_snapshot()
+        if prepared.search:
+            self._save_search_indexes()
+
+    def apply_updates(self, updates: dict) -> list:
+        """
+        Patches the updated schedules into flat_plans, returns a ScheduleChanges per schedule
+        """
+        prepared = self.prepare_updates(updates)
+        changes = self.swap_updates(prepared)
+        self.save_updates(prepared)
+        return changes
+
+    def refresh(self) -> list:
+        """
+        Downloads and patches in the schedules that changed, see apply_updates()
+        """
+        return self.apply_updates(self.fetch_updates())
+
+    def _talks_of(self, url: str) -> list:
+        offset = self._offsets[url]
+        return self.flat_plans[offset:offset + len(self._flat_schedules[url]["title"])]
+
+    def _save_snapshot(self):
+        if not self.use_snapshot:
+            return
+        try:
+            with current_timings().stage("snapshot_save"):
+                save_snapshot(self.snapshot_path, self._snapshot)
+        except OSError as e:
             print(
-                f"{Colour.FAIL}Fahrplan empty. Something is wrong with your urls. Exiting.{Colour.ENDC}"  # noqa: E501
+                f"{Colour.WARNING}Could not write the snapshot {self.snapshot_path}.{Colour.ENDC}",
+                file=sys.stderr,
             )
-            sys.exit()
+            print(e, file=sys.stderr)
 
     def flatten_fahrplans(self):
         self.flat_plans = []
-        for schedule in self.fahrplans:
-            for day in schedule["conference"]["days"]:
-                for room_name, room in day["rooms"].items():
-                    for talk in room:
-                        current_talk = {
-                            "conference_title": schedule["conference"]["title"],
-                            "conference_acronym": schedule["conference"]["acronym"],
-                            "day": day["index"],
-                            "room": room_name,
-                            "title": talk["title"],
-                            "talk_guid": talk.get("guid"),
-                            "talk_id": talk["id"],
-                            "talk_start": talk["start"],
-                            "talk_date": talk["date"],
-                            "talk_duration": talk["duration"],
-                            "talk_description": ""
-                            if talk["description"] is None
-                            else talk["description"],
-                            "talk_abstract": "" if talk["abstract"] is None else talk["abstract"],
-                            "track": "" if talk["track"] is None else talk["track"],
-                            "speakers": ", ".join(
-                                [
-                                    person.get(
-                                        "public_name",
-                                        person.get("full_public_name", ""),
-                                    )
-                                    for person in talk.get("persons", [])
-                                ]
-                            ),
-                        }
-                        self.flat_plans.append(current_talk)
+        self._time_index = None
+        self._interval_index = None
+        self._person_index = None
+        self._substring_indexes = {}
+        self._offsets = {}
+        with current_timings().stage("flatten_fahrplans") as stage:
+            for url in self.urls:
+                if url in self._flat_schedules:
+                    self._offsets[url] = len(self.flat_plans)
+                    self.flat_plans.extend(columns_to_talks(self._flat_schedules[url]))
+            stage.talks = len(self.flat_plans)
 
+    @property
+    def time_index(self) -> TimeIndex:
+        if self._time_index is None:
+            self._time_index = TimeIndex(self.flat_plans)
+        return self._time_index
 
-def is_talk_in_timerange(talk: dict, start: str) -> bool:
-    start_time = parse(start)
-    talk_start = parse(talk["talk_start"])
-    duration = parse(talk["talk_duration"])
-    talk_end = talk_start + dt.timedelta(hours=duration.hour, minutes=duration.minute)
-    current_hour_end = start_time.replace(minute=59)
-    current_hour_begin = start_time.replace(minute=0)
-    talk_in_timerange = talk_start <= start_time <= talk_end
-    talk_starts_in_current_hour = current_hour_begin <= talk_start <= current_hour_end
+    @property
+    def interval_index(self) -> IntervalIndex:
+        if self._interval_index is None:
+            self._interval_index = IntervalIndex(self.flat_plans)
+        return self._interval_index
+
+    @property
+    def person_index(self) -> PersonIndex:
+        if self._person_index is None:
+            self._person_index = PersonIndex(self.flat_plans)
+        return self._person_index
+
+    def substring_index(self, field: str) -> SubstringIndex:
+        if field not in self._substring_indexes:
+            self._substring_indexes[field] = SubstringIndex(self.flat_plans, field)
+        return self._substring_indexes[field]
+
+    def candidates(
+        self,
+        speaker: str = cli_defaults["speaker"],
+        title: str = cli_defaults["title"],
+        track: str = cli_defaults["track"],
+        start: str = cli_defaults["start"],
+        room: str = cli_defaults["room"],
+        filter_past: bool = cli_defaults["no_past"],
+        now: dt.datetime = None,
+        now_next: bool = False,
+        speaker_match: str = cli_defaults["speaker_match"],
+    ) -> list:
+        """
+        Talks that can match the given filters, narrowed down with the indexes
+
+        filter_talk still has to check the candidates.
+        """
+        now = dt.datetime.now().astimezone() if now is None else now
+        position_lists = []
+        if now_next:
+            position_lists.append(self.time_index.now_and_next(now))
+        if start is not None:
+            position_lists.append(self.time_index.in_timerange(start))
+        if filter_past:
+            position_lists.append(self.time_index.not_past(now))
+        if speaker is not None and speaker_match != "substring":
+            position_lists.append(self.person_index.positions(speaker, speaker_match == "prefix"))
+            speaker = None
+        if self.use_indexes:
+            for filter_value, filter_key, field in (
+                (speaker, "speaker", "speakers"),
+                (title, "title", "title"),
+                (track, "track", "track"),
+                (room, "room", "room"),
+            ):
+                if filter_value != cli_defaults[filter_key]:
+                    position_lists.append(self.substring_index(field).search(filter_value))
+        if not position_lists:
+            return self.flat_plans
+        positions = set(min(position_lists, key=len))
+        for position_list in position_lists:
+            positions.intersection_update(position_list)
+        return [self.flat_plans[i] for i in sorted(positions)]
+
+    def query(self, query: "Query", now_next: bool = False) -> list:
+        """
+        All talks matching query, using the indexes for the candidates
+        """
+        candidates = self.candidates(
+            query.speaker,
+            query.title,
+            query.track,
+            query.start,
+            query.room,
+            query.filter_past,
+            query.now,
+            now_next,
+            query.speaker_match,
+        )
+        return query.filter(candidates)
+
+    def _search_indexes(self) -> list:
+        """
+        (offset, full text index) of every loaded schedule, missing indexes are built and saved
+
+        The indexes are big, so they have a file of their own that only searches load.
+        """
+        if self._search is None:
+            self._search = load_search_indexes(self.search_path) if self.use_snapshot else {}
+        indexes = []
+        built_index = False
+        for url, offset in self._offsets.items():
+            key = self._snapshot_keys[url]
+            if key not in self._search:
+                self._search[key] = build_search_index(self._talks_of(url))
+                built_index = True
+            indexes.append((offset, self._search[key]))
+        if built_index:
+            self._save_search_indexes()
+        return indexes
+
+    def _save_search_indexes(self):
+        if not self.use_snapshot:
+            return
+        try:
+            save_search_indexes(
+                self.search_path, self._search, set(self._snapshot["sources"].values())
+            )
+        except OSError as e:
+            print(
+                f"{Colour.WARNING}Could not write the search indexes {self.search_path}.{Colour.ENDC}",  # noqa: E501
+                file=sys.stderr,
+            )
+            print(e, file=sys.stderr)
+
+    def build_indexes(self) -> None:
+        """
+        Builds all indexes up front, for processes that answer many queries
+        """
+        self.use_indexes = True
+        self.time_index
+        self.person_index
+        for field in ("speakers", "title", "track", "room"):
+            self.substring_index(field)
+        self._search_indexes()
+
+    def find(
+        self,
+        query: "Query",
+        search: str = cli_defaults["search"],
+        now_next: bool = False,
+        limit: int = None,
+    ) -> list:
+        """
+        Talks matching query, ranked by search if it is given
+        """
+        if search is not None:
+            with current_timings().stage("search") as stage:
+                talks = self.search(search, limit, query.matches)
+                stage.talks = len(talks)
+            return talks
+        talks = self.query(query, now_next)
+        return talks if limit is None else talks[:limit]
+
+    def search(self, query: str, limit: int = None, accept=None) -> list:
+        """
+        Talks ranked by how well title, speakers, track, abstract and description match query
+
+        The full text index of every schedule is built on the first search and kept next to the
+        snapshot. accept(talk) can reject talks before they are ranked.
+        """
+        results = search_indexes(
+            self._search_indexes(),
+            query,
+            limit,
+            None if accept is None else lambda position: accept(self.flat_plans[position]),
+        )
+        return [self.flat_plans[position] for _, position in results]
+
+    def talks_by_person(self, person_key: str) -> list:
+        """
+        All talks of one person (see Talk.persons), over all loaded conferences
+        """
+        return [self.flat_plans[i] for i in self.person_index.talks_of(person_key)]
+
+    def people(self, name: str = None, prefix: bool = False) -> list:
+        """
+        (person key, name, talks) of everybody found by name (default: everybody), by name
+        """
+        index = self.person_index
+        keys = index.find(name, prefix) if name is not None else list(index.names)
+        people = [(key, index.names[key], self.talks_by_person(key)) for key in keys]
+        return sorted(people, key=lambda person: (normalise_name(person[1]), person[0]))
+
+    def positions_of(self, talk_ids: list) -> list:
+        """
+        Positions of the talks with the given ids or guids, in the order of talk_ids
+        """
+        talk_ids = [str(talk_id) for talk_id in talk_ids]
+        wanted = set(talk_ids)
+        found = defaultdict(list)
+        for position, talk in enumerate(self.flat_plans):
+            for talk_id in (str(talk["talk_id"]), talk["talk_guid"]):
+                if talk_id in wanted:
+                    found[talk_id].append(position)
+        return [position for talk_id in talk_ids for position in found[talk_id]]
+
+    def room_conflicts(self) -> list:
+        """
+        (talk, talk) of every two talks that overlap in the same room, by start of the second
+        """
+        talks = self.flat_plans
+        return [(talks[a], talks[b]) for a, b in self.interval_index.room_conflicts()]
+
+    def parallel_talks(self, talk_id) -> list:
+        """
+        All talks running at the same time as the talk(s) with the id or guid talk_id
+        """
+        own = self.positions_of([talk_id])
+        positions = set()
+        for position in own:
+            positions.update(self.interval_index.parallel_to(position))
+        return [self.flat_plans[i] for i in sorted(positions - set(own))]
+
+    def agenda_conflicts(self, talk_ids: list, only_agenda: bool = True) -> list:
+        """
+        (agenda talk, talk) for every talk that overlaps a talk of the agenda talk_ids
+
+        With only_agenda just the clashes between the talks of the agenda are reported.
+        """
+        agenda = set(self.positions_of(talk_ids))
+        conflicts = []
+        # talks without times clash with nothing
+        for position in sorted(agenda, key=lambda i: (self.flat_plans[i].start_epoch or 0, i)):
+            for other in self.interval_index.parallel_to(position):
+                if other in agenda:
+                    # every clash inside the agenda is reported once
+                    if position < other:
+                        conflicts.append((self.flat_plans[position], self.flat_plans[other]))
+                elif not only_agenda:
+                    conflicts.append((self.flat_plans[position], self.flat_plans[other]))
+        return conflicts
+
+    def talks_in_timerange(self, start: str) -> list:
+        return [self.flat_plans[i] for i in self.time_index.in_timerange(start)]
+
+    def talks_not_past(self, now: dt.datetime) -> list:
+        return [self.flat_plans[i] for i in self.time_index.not_past(now)]
+
+    def now_and_next(self, now: dt.datetime) -> list:
+        """
+        Per room the talks that are running at now and the next talk after now
+        """
+        return [self.flat_plans[i] for i in self.time_index.now_and_next(now)]
+
+
+def _validators(response) -> dict:
+    return {header: response.headers.get(header) for header in ("ETag", "Last-Modified")}
+
+
+def _talk_key(talk: dict):
+    return talk["talk_guid"] or (talk["conference_acronym"], talk["talk_id"])
+
+
+def _match_talks(old_talks: list, new_talks: list) -> list:
+    """
+    (old talk, new talk) for every talk of new_talks in their order, old talk is None for an
+    added one, followed by (old talk, None) for every removed talk in the order of old_talks
+
+    Talks are matched by their guid. Some schedules (33c3, 34c3, 36c3) use a guid for more than
+    one talk, those are matched as a multiset: equal talks first, the rest in schedule order.
+    """
+    old_by_key = defaultdict(list)
+    for talk in old_talks:
+        old_by_key[_talk_key(talk)].append(talk)
+    new_by_key = defaultdict(list)
+    for talk in new_talks:
+        new_by_key[_talk_key(talk)].append(talk)
+    old_of = {}  # id(new talk) -> old talk
+    for key, new_group in new_by_key.items():
+        old_group = old_by_key.get(key, [])
+        rest = []
+        for talk in new_group:
+            equal = next((i for i, old in enumerate(old_group) if old == talk), None)
+            if equal is None:
+                rest.append(talk)
+            else:
+                old_of[id(talk)] = old_group.pop(equal)
+        old_of.update((id(talk), old) for talk, old in zip(rest, old_group))
+    matches = [(old_of.get(id(talk)), talk) for talk in new_talks]
+    matched = {id(old) for old in old_of.values()}
+    matches.extend((talk, None) for talk in old_talks if id(talk) not in matched)
+    return matches
+
+
+class PreparedUpdates:
+    """
+    What Fahrplan.prepare_updates() built and Fahrplan.swap_updates() switches to
+    """
+
+    def __init__(self):
+        self.changes = []
+        # url -> (snapshot key, flattened talk columns, schedule version)
+        self.schedules = {}
+        # snapshot key -> full text index of the updated schedules
+        self.search = {}
+        # the patched talks and their indexes, flat_plans is None if nothing changed
+        self.flat_plans = None
+        self.offsets = {}
+        self.time_index = None
+        self.interval_index = None
+        self.person_index = None
+        self.substring_indexes = {}
+
+
+class ScheduleChanges:
+    """
+    What changed in one schedule between two versions, talks are matched by their guid (see
+    _match_talks)
+    """
+
+    def __init__(self, added: list, removed: list, changed: list):
+        self.conference = None
+        self.old_version = None
+        self.new_version = None
+        self.added = added
+        self.removed = removed
+        # (old talk, new talk)
+        self.changed = changed
+
+    @property
+    def moved(self) -> list:
+        """
+        Changed talks that take place in another room or at another time now
+        """
+        return [
+            (old, new)
+            for old, new in self.changed
+            if (old["room"], old["talk_date"], old["talk_duration"])
+            != (new["room"], new["talk_date"], new["talk_duration"])
+        ]
+
+    def as_dict(self) -> dict:
+        return {
+            "conference": self.conference,
+            "old_version": self.old_version,
+            "new_version": self.new_version,
+            "added": [dict(talk) for talk in self.added],
+            "removed": [dict(talk) for talk in self.removed],
+            "changed": [{"old": dict(old), "new": dict(new)} for old, new in self.changed],
+        }
+
+
+def diff_talks(old_talks: list, new_talks: list, matches: list = None) -> ScheduleChanges:
+    """
+    matches are those of _match_talks(old_talks, new_talks), if they are computed already
+    """
+    matches = _match_talks(old_talks, new_talks) if matches is None else matches
+    return ScheduleChanges(
+        added=[new for old, new in matches if old is None],
+        removed=[old for old, new in matches if new is None],
+        changed=[(old, new) for old, new in matches if None not in (old, new) and old != new],
+    )
+
+
+def flatten_fahrplan(schedule: dict) -> list:
+    conference = schedule["conference"]
+    return [talk for day in conference["days"] for talk in iter_day_talks(conference, day)]
+
+
+def iter_day_talks(conference: dict, day: dict):
+    """
+    Yields the flattened talks of one day of a conference
+    """
+    conference_title = intern_value(conference["title"])
+    conference_acronym = intern_value(conference["acronym"])
+    for room_name, room in day["rooms"].items():
+        room_name = intern_value(room_name)
+        for talk in room:
+            persons = tuple(
+                (intern_value(person_key(person, conference_acronym)), intern_value(person_name(person)))
+                for person in talk.get("persons", [])
+            )
+            yield Talk(
+                conference_title,
+                conference_acronym,
+                day["index"],
+                room_name,
+                talk["title"],
+                talk.get("guid"),
+                talk["id"],
+                intern_value(talk["start"]),
+                talk["date"],
+                intern_value(talk["duration"]),
+                "" if talk["description"] is None else talk["description"],
+                "" if talk["abstract"] is None else talk["abstract"],
+                "" if talk["track"] is None else intern_value(talk["track"]),
+                ", ".join([name for _, name in persons]),
+                persons=persons,
+            )
+
+
+def stream_talks(conferences: list = None, use_cache: bool = True):
+    """
+    Yields the flattened talks of the given conferences (default: all of them)
+
+    Every schedule is downloaded and then parsed day by day, so neither the decoded schedules nor
+    a full list of talks are ever held in memory. Use Fahrplan for the indexes and the snapshot.
+    """
+    import requests
+
+    sources = load_sources()
+    conferences = list(sources) if conferences is None else conferences
+    session = new_session()
+    cache = new_cache(use_cache)
+    for conference in conferences:
+        url = sources[conference]
+        try:
+            if is_local(url):
+                with read_local(url) as content:
+                    text = str(content, "utf-8")
+            elif cache is not None:
+                try:
+                    content = cache.fetch(session, url).read()
+                except zlib.error as e:
+                    cache.forget(url, e)
+                    content = cache.fetch(session, url).read()
+                text = content.decode("utf-8")
+                del content
+            else:
+                response = session.get(url)
+                response.raise_for_status()
+                text = response.content.decode("utf-8")
+                del response
+            for schedule_conference, day in iter_schedule_days(text):
+                yield from iter_day_talks(schedule_conference, day)
+        except (
+            JSONDecodeError, KeyError, UnicodeDecodeError, OSError, requests.RequestException
+        ) as e:
+            print(
+                f"{Colour.FAIL}Problem downloading the Fahrplan {url}. Check your internet connection.{Colour.ENDC}",  # noqa: E501
+                file=sys.stderr,
+            )
+            print(e, file=sys.stderr)
+
+
+def _talk_times(talk: dict) -> tuple:
+    if isinstance(talk, Talk):
+        return talk.start_minute, talk.duration_minutes, talk.start_epoch, talk.end_epoch
+    return talk_times(talk["talk_start"], talk["talk_date"], talk["talk_duration"])
+
+
+def _in_timerange(talk_start: int, duration: int, start_minute: int) -> bool:
+    current_hour_begin = start_minute - start_minute % 60
+    talk_in_timerange = talk_start <= start_minute <= talk_start + duration
+    talk_starts_in_current_hour = current_hour_begin <= talk_start <= current_hour_begin + 59
     return talk_in_timerange or talk_starts_in_current_hour
 
 
+def is_talk_in_timerange(talk: dict, start: str) -> bool:
+    talk_start, duration, _, _ = _talk_times(talk)
+    return talk_start is not None and _in_timerange(talk_start, duration, parse_clock(start))
+
+
 def is_talk_in_past(talk: dict, now: dt.datetime) -> bool:
-    talk_start_datetime = parse(talk["talk_date"])
-    duration = parse(talk["talk_duration"])
-    end = talk_start_datetime + dt.timedelta(hours=duration.hour, minutes=duration.minute)
-    return now > end
+    """
+    Whether talk ended before now, a talk without times never is (but --no-past hides it)
+    """
+    _, _, _, end = _talk_times(talk)
+    return end is not None and now.timestamp() > end
+
+
+class Query:
+    """
+    The filter options of the cli, compiled once into a list of predicates
+
+    Options that are left at their defaults don't produce a predicate, needles are lowercased
+    once and the predicates are ordered cheapest first, so the expensive ones only see the talks
+    that are left over.
+    """
+
+    def __init__(
+        self,
+        speaker: str = cli_defaults["speaker"],
+        title: str = cli_defaults["title"],
+        track: str = cli_defaults["track"],
+        day: int = cli_defaults["day"],
+        start: str = cli_defaults["start"],
+        room: str = cli_defaults["room"],
+        conference: str = cli_defaults["conference"],
+        filter_past: bool = cli_defaults["no_past"],
+        now: dt.datetime = None,
+        speaker_match: str = cli_defaults["speaker_match"],
+    ):
+        self.speaker = speaker
+        self.speaker_match = check_speaker_match(speaker_match)
+        self.title = title
+        self.track = track
+        self.day = day
+        self.start = start
+        self.room = room
+        self.conference = conference
+        self.filter_past = filter_past
+        self.now = dt.datetime.now().astimezone() if now is None else now
+        self.predicates = []
+
+        if day != cli_defaults["day"]:
+            self.predicates.append(lambda talk: talk["day"] == day)
+        if start is not None:
+            start_minute = parse_clock(start)
+
+            def start_matches(talk):
+                talk_start, duration, _, _ = _talk_times(talk)
+                return talk_start is not None and _in_timerange(talk_start, duration, start_minute)
+
+            self.predicates.append(start_matches)
+        if filter_past:
+            now_timestamp = self.now.timestamp()
+
+            def not_past(talk):
+                end = _talk_times(talk)[3]
+                return end is not None and end >= now_timestamp
+
+            self.predicates.append(not_past)
+        # substring matches, short fields first
+        for filter_value, filter_key, talk_attribute in (
+            (conference, "conference", "conference_acronym"),
+            (room, "room", "room"),
+            (track, "track", "track"),
+            (speaker, "speaker", "speakers"),
+            (title, "title", "title"),
+        ):
+            if filter_value == cli_defaults[filter_key]:
+                continue
+            if filter_key == "speaker" and speaker_match != "substring":
+                needle = normalise_name(speaker)
+                self.predicates.append(self._name_match(needle, speaker_match == "prefix"))
+            else:
+                self.predicates.append(self._in_match(filter_value.lower(), talk_attribute))
+
+    @staticmethod
+    def _in_match(needle: str, talk_attribute: str):
+        return lambda talk: needle in talk[talk_attribute].lower()
+
+    @staticmethod
+    def _name_match(needle: str, prefix: bool):
+        def speaker_matches(talk):
+            # plain dicts only have the joined names
+            if isinstance(talk, Talk):
+                names = [name for _, name in talk.persons]
+            else:
+                names = talk["speakers"].split(", ")
+            return any(name_matches(needle, name, prefix) for name in names)
+
+        return speaker_matches
+
+    def matches(self, talk: dict) -> bool:
+        for predicate in self.predicates:
+            if not predicate(talk):
+                return False
+        return True
+
+    def iter_filter(self, talks):
+        """
+        Lazily yields the matching talks, e.g. from stream_talks
+        """
+        for talk in talks:
+            if self.matches(talk):
+                yield talk
+
+    def filter(self, talks: list) -> list:
+        """
+        All matching talks, every predicate narrows the list down in one pass
+        """
+        with current_timings().stage("filter") as stage:
+            talks = list(talks)
+            for predicate in self.predicates:
+                talks = [talk for talk in talks if predicate(talk)]
+            stage.talks = len(talks)
+        return talks
 
 
 def filter_talk(
@@ -119,34 +1033,43 @@ def filter_talk(
     now: dt.datetime = dt.datetime.now().astimezone(),  # evaluated at function definition time, this is fine
 ) -> bool:
     """
-    Some simple filter rules as functions
+    Checks a single talk, use Query directly to filter many talks
     """
+    timings = current_timings()
+    if not timings.enabled:
+        return Query(speaker, title, track, day, start, room, conference, filter_past, now).matches(talk)
+    with timings.stage("filter_talk") as stage:
+        matches = Query(speaker, title, track, day, start, room, conference, filter_past, now).matches(talk)
+        stage.talks = int(matches)
+    return matches
 
-    def generic_in_match(filter_value, filter_key, talk_attribute):
-        return (
-            filter_value == cli_defaults[filter_key]
-            or filter_value.lower() in talk[talk_attribute].lower()
-        )
 
-    def day_matches():
-        return day == -1 or day == talk["day"]
+OUTPUT_FORMATS = ("table", "jsonl", "tsv", "csv")
 
-    def start_matches():
-        return start is None or is_talk_in_timerange(talk, start)
 
-    def filtered_as_past():
-        return filter_past and is_talk_in_past(talk, now)
+def select_talks(talks, sort_by: str = None, reverse: bool = False, limit: int = None):
+    """
+    Sorts (by the displayed string of sort_by) and limits talks
 
-    return (
-        generic_in_match(conference, "conference", "conference_acronym")
-        and generic_in_match(speaker, "speaker", "speakers")
-        and generic_in_match(title, "title", "title")
-        and generic_in_match(track, "track", "track")
-        and day_matches()
-        and start_matches()
-        and generic_in_match(room, "room", "room")
-        and not filtered_as_past()
-    )
+    Without sort_by and reverse the talks are passed through lazily. With a limit only limit
+    talks are ever kept, the top ones are picked with a bounded heap instead of a full sort.
+    """
+    if sort_by is None:
+        if not reverse:
+            return talks if limit is None else islice(talks, limit)
+        if limit is None:
+            return list(talks)[::-1]
+        return list(deque(talks, maxlen=limit))[::-1]
+    # the position breaks ties, so reverse gives the same order as a sort followed by reverse()
+    decorated = ((str(talk.get(sort_by, "")), position, talk) for position, talk in enumerate(talks))
+    key = itemgetter(0, 1)
+    if limit is None:
+        rows = sorted(decorated, key=key, reverse=reverse)
+    elif reverse:
+        rows = heapq.nlargest(limit, decorated, key=key)
+    else:
+        rows = heapq.nsmallest(limit, decorated, key=key)
+    return [talk for _, _, talk in rows]
 
 
 def print_formatted_talks(
@@ -154,9 +1077,10 @@ def print_formatted_talks(
     show_abstract: bool,
     show_description: bool,
     sort_by: str,
-    reverse: bool
+    reverse: bool,
+    output_format: str = "table",
+    limit: int = None,
 ) -> None:
-    console = Console()
     header = [
         "Conference",
         "Day",
@@ -180,31 +1104,185 @@ def print_formatted_talks(
 
     if show_abstract:
         header.append("Abstract")
+        fields.append("talk_abstract")
     if show_description:
         header.append("Description")
-    data = []
-
-    for talk in talks:
-        current_data_point = [str(talk.get(field, "")) for field in fields]
-        if show_abstract:
-            current_data_point.append(talk["talk_abstract"])
-        if show_description:
-            current_data_point.append(talk["talk_description"])
-        # TODO think about coloring every second row (needs theming and config tho)
-        data.append(current_data_point)
-    try:
-        if sort_by is not None:
-            data.sort(key=lambda x: x[fields.index(sort_by)])
-        if reverse:
-            data.reverse()
-        table = Table(
-            title=f"Your conference information for {data[0][0]}",
-            show_lines=True
+        fields.append("talk_description")
+    timings = current_timings()
+    # with --stream the talks are downloaded and filtered while they are rendered
+    with timings.stage("render"):
+        talks = timings.count("render", select_talks(talks, sort_by, reverse, limit))
+        _print_talks(talks, header, fields, output_format)
+
+
+def _print_talks(talks, header: list, fields: list, output_format: str) -> None:
+    if output_format == "jsonl":
+        for talk in talks:
+            row = {field: talk.get(field, "") for field in fields}
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return
+    if output_format in ("csv", "tsv"):
+        writer = csv.writer(sys.stdout, delimiter="\t" if output_format == "tsv" else ",")
+        writer.writerow(header)
+        for talk in talks:
+            writer.writerow([talk.get(field, "") for field in fields])
+        return
+
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+    # TODO think about coloring every second row (needs theming and config tho)
+    data = [[str(talk.get(field, "")) for field in fields] for talk in talks]
+    if not data:
+        console.print("No talks in this period.")
+        return
+    table = Table(
+        title=f"Your conference information for {data[0][0]}",
+        show_lines=True
+    )
+    for column in header:
+        table.add_column(column)
+    for row in data:
+        table.add_row(*row)
+    console.print(table)
+
+
+def print_conflicts(conflicts: list, title: str) -> None:
+    """
+    Prints (talk, talk) pairs as returned by Fahrplan.room_conflicts or agenda_conflicts
+    """
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+    if not conflicts:
+        console.print("No overlapping talks.")
+        return
+    table = Table(title=f"{title}: {len(conflicts)}", show_lines=True)
+    for column in ("Conference", "Day", "Talk", "Room", "Time", "Overlaps with", "Room", "Time"):
+        table.add_column(column)
+
+    def talk_time(talk):
+        return f"{talk['talk_start']} ({talk['talk_duration']})"
+
+    for talk, other in conflicts:
+        table.add_row(
+            talk["conference_acronym"],
+            str(talk["day"]),
+            talk["title"],
+            talk["room"],
+            talk_time(talk),
+            other["title"],
+            other["room"],
+            talk_time(other),
         )
-        for column in header:
-            table.add_column(column)
-        for row in data:
-            table.add_row(*row)
-        console.print(table)
-    except (ValueError, IndexError):
-        console.print("No talks in this period.")
\ No newline at end of file
+    console.print(table)
+
+
+def print_people(people: list, show_talks: bool = False) -> None:
+    """
+    Prints (person key, name, talks) as returned by Fahrplan.people
+    """
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+    if not people:
+        console.print("No speakers found.")
+        return
+    table = Table(title=f"{len(people)} speakers", show_lines=show_talks)
+    for column in ("Speaker", "Talks", "Conferences"):
+        table.add_column(column)
+    if show_talks:
+        table.add_column("Titles")
+    for _, name, talks in people:
+        conferences = Counter(talk["conference_acronym"] for talk in talks)
+        row = [
+            name,
+            str(len(talks)),
+            ", ".join(f"{conference} ({count})" for conference, count in conferences.items()),
+        ]
+        if show_talks:
+            row.append("\n".join(talk["title"] for talk in talks))
+        table.add_row(*row)
+    console.print(table)
+
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "KiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} MiB"
+
+
+def print_cache_stats(stats: list, sources: dict, max_size: int) -> None:
+    """
+    Prints the per url dicts of ScheduleCache.stats, urls are shown by their conference
+    """
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+    if not stats:
+        console.print("The cache is empty.")
+        return
+    conferences = {location: acronym for acronym, location in sources.items()}
+    table = Table(title="Fahrplan cache")
+    for column in ("Conference", "Size", "Compressed", "Policy"):
+        table.add_column(column)
+    for counter in STAT_COUNTERS:
+        table.add_column(counter.capitalize(), justify="right")
+    table.add_column("Hit rate", justify="right")
+    for url_stats in stats:
+        if not url_stats["cached"]:
+            policy = "evicted"
+        elif url_stats["immutable"]:
+            policy = "immutable"
+        elif url_stats["expires_in"] > 0:
+            policy = f"fresh for {url_stats['expires_in'] / 60:.0f} min"
+        else:
+            policy = "revalidate"
+        table.add_row(
+            conferences.get(url_stats["url"], url_stats["url"]),
+            _format_size(url_stats["size"]),
+            _format_size(url_stats["stored_size"]),
+            policy,
+            *(str(url_stats[counter]) for counter in STAT_COUNTERS),
+            f"{url_stats['hit_rate']:.0%}",
+        )
+    console.print(table)
+    requests = sum(url_stats[counter] for url_stats in stats for counter in STAT_COUNTERS)
+    served = sum(url_stats["hits"] + url_stats["revalidated"] for url_stats in stats)
+    console.print(
+        f"{_format_size(sum(url_stats['stored_size'] for url_stats in stats))} of "
+        f"{_format_size(max_size)} used, {served} of {requests} requests answered without a download"
+    )
+
+
+def print_changes(changes: list) -> None:
+    """
+    What refresh() changed, to stderr, stdout is left to the talks
+    """
+    from rich.console import Console
+
+    console = Console(stderr=True)
+    if not changes:
+        console.print("No fahrplan changed.")
+    for schedule_changes in changes:
+        console.print(
+            f"{schedule_changes.conference}: version {schedule_changes.old_version} -> {schedule_changes.new_version}"  # noqa: E501
+        )
+        for talk in schedule_changes.added:
+            console.print(f"  added: {talk['title']} ({talk['talk_date']}, {talk['room']})")
+        for talk in schedule_changes.removed:
+            console.print(f"  removed: {talk['title']}")
+        moved = schedule_changes.moved
+        for old, new in moved:
+            console.print(
+                f"  moved: {new['title']} from {old['talk_date']}, {old['room']} to {new['talk_date']}, {new['room']}"  # noqa: E501
+            )
+        for old, new in schedule_changes.changed:
+            if (old, new) not in moved:
+                console.print(f"  changed: {new['title']}")
@@ -2,10 +2,10 @@ import datetime as dt
 
 import click
 
-from pyfahrplan.config import config_defaults as cli_defaults
-from pyfahrplan.lib import Fahrplan, filter_talk, print_formatted_talks
+from pyfahrplan.config import config_defaults as cli_defaults, conferences_matching, speaker_matches
 
-@click.command()
+
+@click.group(invoke_without_command=True)
 @click.option(
     "--conference",
     "-c",
@@ -25,6 +25,12 @@ from pyfahrplan.lib import Fahrplan, filter_talk, print_formatted_talks
     help="Name of the room you want to filter [room names] or 'all' for all rooms",
 )
 @click.option("--speaker", "-s", default=None, help="Name of a speaker you want to search.")
+@click.option(
+    "--speaker-match",
+    default=cli_defaults["speaker_match"],
+    type=click.Choice(speaker_matches),
+    help="How --speaker is matched: anywhere in the speakers, or exactly / as a prefix against a speaker's name or one part of it",
+)
 @click.option(
     "--start",
     "-st",
@@ -44,6 +50,12 @@ from pyfahrplan.lib import Fahrplan, filter_talk, print_formatted_talks
     default=cli_defaults["track"],
     help="A part of the track description you want to search.",
 )
+@click.option(
+    "--search",
+    "-q",
+    default=cli_defaults["search"],
+    help="Words to search in titles, speakers, tracks, abstracts and descriptions, best matches first.",
+)
 @click.option("--reverse", default=False, help="Reverse results", is_flag=True)
 @click.option(
     "--show-abstract",
@@ -63,10 +75,29 @@ from pyfahrplan.lib import Fahrplan, filter_talk, print_formatted_talks
     type=click.Choice(["day", "speakers", "title", "track", "room", "talk_start"]),
     help="Sort by day|speakers|title|track|room|talk_start",
 )
+@click.option(
+    "--format",
+    "output_format",
+    default=cli_defaults["format"],
+    type=click.Choice(["table", "jsonl", "tsv", "csv"]),
+    help="Output format, everything but table is written talk by talk",
+)
+@click.option(
+    "--limit",
+    default=cli_defaults["limit"],
+    type=click.IntRange(min=1),
+    help="Only show the first N talks (after sorting)",
+)
 @click.option(
     "--update-cache",
     default=cli_defaults["update_cache"],
-    help="Delete the cache file and redownload all fahrplans",
+    help="Download the fahrplans that changed since they were cached",
+    is_flag=True,
+)
+@click.option(
+    "--changes",
+    default=False,
+    help="Print what changed in the fahrplans, implies --update-cache",
     is_flag=True,
 )
 @click.option(
@@ -75,10 +106,56 @@ from pyfahrplan.lib import Fahrplan, filter_talk, print_formatted_talks
     help="Filter out talks that lay in the past",
     is_flag=True,
 )
+@click.option(
+    "--now-next",
+    default=False,
+    help="Only show the talks running now and the next talk in every room",
+    is_flag=True,
+)
+@click.option(
+    "--stream",
+    default=False,
+    help="Parse the fahrplans day by day while filtering instead of loading them first, uses less memory",
+    is_flag=True,
+)
+@click.option(
+    "--no-server",
+    default=False,
+    help="Don't ask a running 'pyfahrplan serve' for the talks, always load them locally",
+    is_flag=True,
+)
+@click.option(
+    "--max-workers",
+    default=cli_defaults["max_workers"],
+    help="Number of fahrplans that are downloaded in parallel",
+)
+@click.option(
+    "--timings",
+    "show_timings",
+    default=False,
+    help="Print the time spent per stage and the cache use per url to stderr",
+    is_flag=True,
+)
+@click.option(
+    "--timings-file",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the timings as JSON to this file",
+)
+@click.option(
+    "--profile",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write cProfile stats of the whole run to this file (read them with pstats or snakeviz)",
+)
+@click.pass_context
 def cli(
+    ctx,
     speaker,
+    speaker_match,
     title,
     track,
+    search,
     day,
     start: dt.datetime,
     room,
@@ -87,23 +164,364 @@ def cli(
     conference,
     sort,
     reverse,
+    output_format,
+    limit,
     update_cache,
+    changes,
     no_past,
+    now_next,
+    stream,
+    no_server,
+    max_workers,
+    show_timings,
+    timings_file,
+    profile,
 ):
+    if ctx.invoked_subcommand is not None:
+        return
+    if show_timings or timings_file or profile:
+        _instrument(ctx, show_timings, timings_file, profile)
+    # imported here, so --help and the subcommands don't import them, pyfahrplan.lib itself
+    # only imports requests and rich when it needs them
+    from pyfahrplan.client import query_server
+    from pyfahrplan.lib import Fahrplan, Query, print_changes, print_formatted_talks, stream_talks
+    from pyfahrplan.timings import current as current_timings
+
     now = dt.datetime.now().astimezone()
     start = None if start is None else f"{start.hour}:{start.minute}"
-    matching_talks = [
-        x
-        for x in Fahrplan(update_cache=update_cache).flat_plans
-        if filter_talk(x, speaker, title, track, day, start, room, conference, no_past, now)
-    ]
+    query = Query(speaker, title, track, day, start, room, conference, no_past, now, speaker_match)
+    if stream:
+        if search is not None or now_next:
+            raise click.UsageError("--search and --now-next can't be combined with --stream")
+        print_formatted_talks(
+            query.iter_filter(stream_talks(conferences_matching(conference))),
+            show_abstract,
+            show_description,
+            sort_by=sort,
+            reverse=reverse,
+            output_format=output_format,
+            limit=limit,
+        )
+        return
+    update_cache = update_cache or changes
+    if search is not None and limit is None:
+        limit = cli_defaults["search_limit"]
+    # the server can only cut the talks short if they don't have to be sorted first
+    server_limit = limit if search is not None or (sort is None and not reverse) else None
+    if not (no_server or update_cache):
+        with current_timings().stage("server_query"):
+            matching_talks = query_server({
+                "speaker": speaker,
+                "speaker_match": speaker_match,
+                "title": title,
+                "track": track,
+                "day": day,
+                "start": start,
+                "room": room,
+                "conference": conference,
+                "no_past": no_past,
+                "now_next": now_next,
+                "search": search,
+                "limit": server_limit,
+            })
+        if matching_talks is not None:
+            print_formatted_talks(
+                matching_talks,
+                show_abstract,
+                show_description,
+                sort_by=sort,
+                reverse=reverse,
+                output_format=output_format,
+                limit=limit,
+            )
+            return
+    fahrplan = Fahrplan(
+        update_cache=update_cache,
+        max_workers=max_workers,
+        conferences=conferences_matching(conference),
+    )
+    if changes:
+        print_changes(fahrplan.changes)
+    matching_talks = fahrplan.find(query, search, now_next, limit if search is not None else None)
     print_formatted_talks(
         matching_talks,
         show_abstract,
         show_description,
         sort_by=sort,
         reverse=reverse,
+        output_format=output_format,
+        limit=limit,
+    )
+
+
+def _instrument(ctx, show_timings: bool, timings_file: str, profile: str) -> None:
+    """
+    Records timings and/or a cProfile of the run, they are written when the cli exits
+    """
+    from pyfahrplan import timings
+
+    recorded = timings.enable() if show_timings or timings_file else None
+    profiler = None
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def write_results():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if recorded is None:
+            return
+        timings.disable()
+        if timings_file:
+            import json
+
+            with open(timings_file, "w") as f:
+                json.dump(recorded.as_dict(), f, indent=2)
+        if show_timings:
+            click.echo(recorded.format(), err=True)
+
+    ctx.call_on_close(write_results)
+
+
+@cli.command("serve")
+@click.option("--host", default=cli_defaults["server_host"], help="Address to listen on")
+@click.option("--port", default=cli_defaults["server_port"], help="Port to listen on")
+@click.option(
+    "--refresh-interval",
+    default=cli_defaults["refresh_interval"],
+    help="Seconds between two downloads of the fahrplans",
+)
+def serve_command(host, port, refresh_interval):
+    """
+    Keep all fahrplans loaded and answer queries on http://HOST:PORT/talks
+    """
+    from pyfahrplan.server import serve
+
+    serve(host, port, refresh_interval)
+
+
+@cli.command("batch")
+@click.argument("specs", type=click.File("r"))
+@click.option(
+    "--processes",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Evaluate the queries in this many processes, pays off for thousands of queries",
+)
+@click.option(
+    "--max-workers",
+    default=cli_defaults["max_workers"],
+    help="Number of fahrplans that are downloaded in parallel",
+)
+def batch_command(specs, processes, max_workers):
+    """
+    Answer every query of the JSONL file SPECS ('-' for stdin), one JSON line per query
+
+    Every line is an object with the options of pyfahrplan (speaker, speaker_match, title, track,
+    day, start, room, conference, no_past, now_next, search, limit, sort, reverse) and an id. The fahrplans
+    are loaded once for all queries, the results are {"id": ..., "talks": [...]}.
+    """
+    import json
+    import sys
+
+    from pyfahrplan.batch import read_specs, run_batch
+
+    for result in run_batch(read_specs(specs), processes=processes, max_workers=max_workers):
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+@cli.command("speakers")
+@click.argument("name", required=False)
+@click.option(
+    "--conference",
+    "-c",
+    default=cli_defaults["conference"],
+    help="CCC acronym (32c3 to 36c3 plus rc3 and rc3-2021) or 'all' for all conferences",
+)
+@click.option("--prefix", default=False, is_flag=True, help="Find NAME as a prefix of a name")
+@click.option("--talks", "show_talks", default=False, is_flag=True, help="List the talks of every speaker")
+@click.option(
+    "--max-workers",
+    default=cli_defaults["max_workers"],
+    help="Number of fahrplans that are downloaded in parallel",
+)
+def speakers_command(name, conference, prefix, show_talks, max_workers):
+    """
+    List the speakers (found by NAME) with the number of their talks per conference
+
+    NAME is matched exactly (or as a prefix with --prefix) against a speaker's whole name and
+    every part of it, umlauts and accents don't matter.
+    """
+    from pyfahrplan.lib import Fahrplan, print_people
+
+    fahrplan = Fahrplan(max_workers=max_workers, conferences=conferences_matching(conference))
+    print_people(fahrplan.people(name, prefix), show_talks)
+
+
+@cli.command("conflicts")
+@click.option(
+    "--conference",
+    "-c",
+    default=cli_defaults["conference"],
+    help="CCC acronym (32c3 to 36c3 plus rc3 and rc3-2021) or 'all' for all conferences",
+)
+@click.option(
+    "--agenda",
+    "-a",
+    multiple=True,
+    help="Id or guid of a talk you want to attend (repeatable or comma separated), shows which of them clash",
+)
+@click.option(
+    "--all-overlaps",
+    default=False,
+    is_flag=True,
+    help="With --agenda, show every talk that overlaps a talk of the agenda",
+)
+@click.option("--parallel", default=None, help="Id or guid of a talk, lists all talks running at the same time")
+@click.option(
+    "--format",
+    "output_format",
+    default=cli_defaults["format"],
+    type=click.Choice(["table", "jsonl", "tsv", "csv"]),
+    help="Output format of --parallel",
+)
+@click.option(
+    "--update-cache",
+    default=cli_defaults["update_cache"],
+    help="Download the fahrplans that changed since they were cached",
+    is_flag=True,
+)
+@click.option(
+    "--max-workers",
+    default=cli_defaults["max_workers"],
+    help="Number of fahrplans that are downloaded in parallel",
+)
+def conflicts_command(conference, agenda, all_overlaps, parallel, output_format, update_cache, max_workers):
+    """
+    Show double booked rooms, clashes in your agenda or the talks parallel to a talk
+    """
+    from pyfahrplan.lib import Fahrplan, print_conflicts, print_formatted_talks
+
+    fahrplan = Fahrplan(
+        update_cache=update_cache,
+        max_workers=max_workers,
+        conferences=conferences_matching(conference),
     )
+    if parallel is not None:
+        print_formatted_talks(fahrplan.parallel_talks(parallel), False, False, None, False, output_format)
+    elif agenda:
+        talk_ids = [talk_id.strip() for ids in agenda for talk_id in ids.split(",") if talk_id.strip()]
+        print_conflicts(fahrplan.agenda_conflicts(talk_ids, not all_overlaps), "Clashes in your agenda")
+    else:
+        print_conflicts(fahrplan.room_conflicts(), "Double booked rooms")
+
+
+@cli.command("mirror")
+@click.argument("directory", required=False, type=click.Path(file_okay=False))
+@click.option(
+    "--conference",
+    "-c",
+    default=cli_defaults["conference"],
+    help="CCC acronym (32c3 to 36c3 plus rc3 and rc3-2021) or 'all' for all conferences",
+)
+@click.option(
+    "--max-workers",
+    default=cli_defaults["max_workers"],
+    help="Number of fahrplans that are downloaded in parallel",
+)
+def mirror_command(directory, conference, max_workers):
+    """
+    Download the fahrplans into DIRECTORY (default: the configured mirror) as
+    <acronym>.schedule.json
+
+    pyfahrplan reads the fahrplans from the mirror set in the sources config or in
+    $PYFAHRPLAN_MIRROR instead of downloading them, e.g. on machines without internet.
+    """
+    from pyfahrplan.sources import load_sources, mirror, mirror_directory
+
+    directory = directory or mirror_directory()
+    if directory is None:
+        raise click.UsageError("Give a DIRECTORY or configure a mirror")
+    sources = load_sources(use_mirror=False)
+    acronyms = conferences_matching(conference, list(sources))
+    results = mirror({acronym: sources[acronym] for acronym in acronyms}, directory, max_workers)
+    for acronym, result in results.items():
+        click.echo(f"{acronym}: {result}")
+    if any(result.startswith("failed") for result in results.values()):
+        ctx = click.get_current_context()
+        ctx.exit(1)
+
+
+@cli.group("cache")
+def cache_group():
+    """
+    Show or prune the cache of downloaded fahrplans
+    """
+
+
+@cache_group.command("stats")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "json"]),
+    default="table",
+    help="Print a table or one JSON object per url",
+)
+def cache_stats_command(output_format):
+    """
+    Sizes, cache policy, hits, revalidations and downloads per fahrplan
+    """
+    import json
+
+    from pyfahrplan.lib import new_cache, print_cache_stats
+    from pyfahrplan.sources import load_sources
+
+    import sqlite3
+
+    cache = new_cache()
+    try:
+        stats = cache.stats()
+    except sqlite3.Error as e:
+        raise click.ClickException(f"The fahrplan cache {cache.path} can't be used: {e}")
+    if output_format == "json":
+        for url_stats in stats:
+            click.echo(json.dumps(url_stats))
+    else:
+        print_cache_stats(stats, load_sources(), cache.max_size)
+
+
+@cache_group.command("prune")
+@click.option(
+    "--max-size",
+    type=float,
+    default=None,
+    help="Evict the least recently used fahrplans until the cache fits into this many MiB",
+)
+@click.option(
+    "--all",
+    "remove_all",
+    default=False,
+    is_flag=True,
+    help="Empty the cache, e.g. to download the fahrplans of finished conferences again",
+)
+def cache_prune_command(max_size, remove_all):
+    """
+    Evict the least recently used fahrplans that exceed the size limit
+    """
+    from pyfahrplan.lib import new_cache
+
+    cache = new_cache()
+    if remove_all:
+        max_size = 0
+    elif max_size is not None:
+        max_size = int(max_size * 1024 * 1024)
+    removed = cache.evict(max_size)
+    click.echo(f"Removed {len(removed)} fahrplans from the cache")
+    for url in removed:
+        click.echo(f"  {url}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+from collections import Counter, defaultdict
+from functools import lru_cache
+import heapq
+import math
+import re
+import unicodedata
+
+# the fields --search looks at, the title counts twice
+SEARCH_FIELDS = ("title", "title", "speakers", "track", "talk_abstract", "talk_description")
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+STOPWORDS = frozenset(
+    """
+    a an and are as at be by for from how in into is it of on or that the this to was what
+    when which who why will with you your we our
+    aber als am an auch auf aus bei bin bis das dass dem den der des die ein eine einem einen
+    einer eines er es fuer ich ihr im in ist mit nach nicht noch oder sich sie sind so ueber
+    um und uns von vor wie wir wird zu zum zur
+    """.split()
+)
+
+TOKEN_RE = re.compile(r"\w+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def normalise(text: str) -> str:
+    """
+    Casefolds, folds umlauts (ä -> ae) and strips all other accents (é -> e)
+    """
+    return strip_accents(text.casefold().translate(UMLAUTS))
+
+
+def strip_accents(text: str) -> str:
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+@lru_cache(maxsize=65536)
+def _fold(token: str) -> str:
+    return normalise(token)
+
+
+def tokenise(text: str) -> list:
+    # folding only the non ascii words is a lot cheaper than normalising whole descriptions
+    tokens = (
+        token if token.isascii() else _fold(token)
+        for token in TOKEN_RE.findall(text.casefold())
+    )
+    return [token for token in tokens if len(token) > 1 and token not in STOPWORDS]
+
+
+def build_search_index(talks: list) -> dict:
+    """
+    Inverted index of one schedule: {"postings": {term: [(position, tf), ...]}, "lengths": [...]}
+
+    Positions are the positions of the talks in the given list. The index is a plain dict so it
+    can be stored in the snapshot next to the flattened talks.
+    """
+    postings = defaultdict(list)
+    lengths = []
+    for position, talk in enumerate(talks):
+        tokens = []
+        for field in SEARCH_FIELDS:
+            tokens.extend(tokenise(talk[field] or ""))
+        lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings[term].append((position, tf))
+    return {"postings": dict(postings), "lengths": lengths}
+
+
+def search(indexes: list, query: str, limit: int = None, accept=None) -> list:
+    """
+    BM25 ranked search over several schedule indexes
+
+    indexes is a list of (offset, index), offset is added to the positions of that index. Only
+    talks that contain at least one query term are scored, accept(position) can reject talks
+    before they are ranked. Returns up to limit (score, position) tuples, best first.
+    """
+    terms = set(tokenise(query))
+    document_count = sum(len(index["lengths"]) for _, index in indexes)
+    if not terms or not document_count:
+        return []
+    average_length = sum(sum(index["lengths"]) for _, index in indexes) / document_count
+    scores = defaultdict(float)
+    for term in terms:
+        document_frequency = sum(len(index["postings"].get(term, ())) for _, index in indexes)
+        if not document_frequency:
+            continue
+        idf = math.log(
+            1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5)
+        )
+        for offset, index in indexes:
+            lengths = index["lengths"]
+            for position, tf in index["postings"].get(term, ()):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[position] / average_length)
+                scores[offset + position] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+    results = (
+        (score, position)
+        for position, score in scores.items()
+        if accept is None or accept(position)
+    )
+    # ties are broken by the position, so results stay in schedule order
+    key = lambda result: (result[0], -result[1])  # noqa: E731
+    if limit is None:
+        return sorted(results, key=key, reverse=True)
+    return heapq.nlargest(limit, results, key=key)
@@ -0,0 +1,155 @@
+import datetime as dt
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from pyfahrplan.config import config_defaults as cli_defaults, Colour
+
+# query parameter -> (Query argument, type)
+QUERY_PARAMETERS = {
+    "speaker": ("speaker", str),
+    "speaker_match": ("speaker_match", str),
+    "title": ("title", str),
+    "track": ("track", str),
+    "day": ("day", int),
+    "start": ("start", str),
+    "room": ("room", str),
+    "conference": ("conference", str),
+    "no_past": ("filter_past", bool),
+}
+
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+class FahrplanServer(ThreadingHTTPServer):
+    """
+    Keeps one loaded Fahrplan with all its indexes and answers queries over localhost HTTP
+
+    GET /talks takes the cli filters as query parameters (speaker, speaker_match, title, track,
+    day, start, room, conference, no_past, now_next, search, limit) and returns {"talks": [...]}.
+    GET /status returns the loaded conferences and the time of the last change.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, fahrplan_factory, refresh_interval: int):
+        """
+        fahrplan_factory() returns the Fahrplan to serve, it is refreshed every refresh_interval
+        seconds
+        """
+        super().__init__(address, FahrplanRequestHandler)
+        self.refresh_interval = refresh_interval
+        self.fahrplan = fahrplan_factory()
+        self.fahrplan.build_indexes()
+        self.loaded_at = time.time()
+        # queries and patching in updates must not overlap
+        self.lock = threading.Lock()
+        self._stop_refreshing = threading.Event()
+
+    def refresh(self) -> list:
+        # downloading and building the patched talks and indexes happen outside of the lock,
+        # queries are only blocked while the new ones are swapped in
+        updates = self.fahrplan.fetch_updates()
+        if not updates:
+            return []
+        prepared = self.fahrplan.prepare_updates(updates)
+        with self.lock:
+            changes = self.fahrplan.swap_updates(prepared)
+            self.loaded_at = time.time()
+        self.fahrplan.save_updates(prepared)
+        return changes
+
+    def refresh_forever(self) -> None:
+        while not self._stop_refreshing.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:  # keep serving the old fahrplan
+                print(f"{Colour.FAIL}Refreshing the fahrplans failed.{Colour.ENDC}", file=sys.stderr)
+                print(e, file=sys.stderr)
+
+    def start_refreshing(self) -> threading.Thread:
+        thread = threading.Thread(target=self.refresh_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def server_close(self):
+        self._stop_refreshing.set()
+        super().server_close()
+
+
+class FahrplanRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/status":
+            with self.server.lock:
+                status = {
+                    "conferences": self.server.fahrplan.conferences,
+                    "talks": len(self.server.fahrplan.flat_plans),
+                    "loaded_at": self.server.loaded_at,
+                }
+            self._send_json(200, status)
+        elif url.path == "/talks":
+            try:
+                talks = self._find_talks(parse_qs(url.query))
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(200, {"talks": [talk.as_dict() for talk in talks]})
+        else:
+            self._send_json(404, {"error": f"Unknown path {url.path}"})
+
+    def _find_talks(self, parameters: dict) -> list:
+        from pyfahrplan.lib import Query
+
+        arguments = {}
+        for parameter, (argument, parameter_type) in QUERY_PARAMETERS.items():
+            if parameter in parameters:
+                value = parameters[parameter][-1]
+                arguments[argument] = _parse_bool(value) if parameter_type is bool else parameter_type(value)
+        query = Query(now=dt.datetime.now().astimezone(), **arguments)
+        limit = parameters.get("limit", [None])[-1]
+        with self.server.lock:
+            return self.server.fahrplan.find(
+                query,
+                search=parameters.get("search", [cli_defaults["search"]])[-1],
+                now_next=_parse_bool(parameters.get("now_next", ["false"])[-1]),
+                limit=None if limit is None else int(limit),
+            )
+
+    def _send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per query would drown the console of a busy kiosk
+        pass
+
+
+def serve(
+    host: str = cli_defaults["server_host"],
+    port: int = cli_defaults["server_port"],
+    refresh_interval: int = cli_defaults["refresh_interval"],
+    fahrplan_factory=None,
+) -> None:
+    if fahrplan_factory is None:
+        from pyfahrplan.lib import Fahrplan
+
+        fahrplan_factory = Fahrplan
+    server = FahrplanServer((host, port), fahrplan_factory, refresh_interval)
+    server.start_refreshing()
+    print(f"Serving {len(server.fahrplan.flat_plans)} talks on http://{host}:{port}/talks")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
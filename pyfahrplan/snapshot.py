@@ -0,0 +1,123 @@
+import hashlib
+import mmap
+import os
+from pathlib import Path
+import pickle
+
+from pyfahrplan.talk import INTERNED_FIELDS, TALK_FIELDS, TIME_FIELDS, Talk, intern_value
+
+# bump this whenever the output of flatten_fahrplan changes, old snapshots are ignored then
+FLATTEN_VERSION = 4
+# bump this whenever the layout of the snapshot file changes
+SNAPSHOT_VERSION = 5
+
+
+def content_digest(content: bytes) -> str:
+    """
+    Hash of a raw schedule, independent of how it is flattened
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def digest_snapshot_key(digest: str) -> str:
+    """
+    Key of a flattened schedule: the content digest plus the flatten version
+    """
+    return f"{digest}-flatten-v{FLATTEN_VERSION}"
+
+
+def snapshot_key(content: bytes) -> str:
+    return digest_snapshot_key(content_digest(content))
+
+
+def talks_to_columns(talks: list) -> dict:
+    columns = {field: [talk[field] for talk in talks] for field in TALK_FIELDS}
+    columns.update({field: [getattr(talk, field) for talk in talks] for field in TIME_FIELDS})
+    columns["persons"] = [talk.persons for talk in talks]
+    # interned values are the same object in every row, so pickle stores them only once
+    for field in INTERNED_FIELDS:
+        columns[field] = [intern_value(value) for value in columns[field]]
+    return columns
+
+
+def columns_to_talks(columns: dict) -> list:
+    rows = zip(*(columns[field] for field in TALK_FIELDS + TIME_FIELDS))
+    return [Talk(*row, persons=persons) for row, persons in zip(rows, columns["persons"])]
+
+
+def empty_snapshot() -> dict:
+    # sources maps schedule urls to the snapshot key of their last seen content and versions the
+    # version field of the schedules. The full text indexes are kept in a file of their own, see
+    # load_search_indexes, only searches have to load them.
+    return {
+        "version": SNAPSHOT_VERSION,
+        "sources": {},
+        "schedules": {},
+        "versions": {},
+    }
+
+
+def _load_pickle(path: Path):
+    """
+    The versioned dict pickled in path, None if it is missing, broken or of another version
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = pickle.loads(mm)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        # missing, empty or broken, it is just rebuilt
+        return None
+    if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+        return None
+    return data
+
+
+def _save_pickle(path: Path, data: dict) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: Path) -> dict:
+    """
+    Returns {"sources": {url: snapshot_key}, "schedules": {snapshot_key: columns},
+    "versions": {snapshot_key: schedule version}}, empty if there is no usable snapshot
+    """
+    snapshot = _load_pickle(path)
+    return empty_snapshot() if snapshot is None else snapshot
+
+
+def save_snapshot(path: Path, snapshot: dict) -> None:
+    """
+    Atomically replaces the snapshot, schedules that no source refers to anymore are dropped
+    """
+    used_keys = set(snapshot["sources"].values())
+    _save_pickle(path, {
+        "version": SNAPSHOT_VERSION,
+        "sources": snapshot["sources"],
+        "schedules": {
+            key: columns for key, columns in snapshot["schedules"].items() if key in used_keys
+        },
+        "versions": {
+            key: version for key, version in snapshot["versions"].items() if key in used_keys
+        },
+    })
+
+
+def load_search_indexes(path: Path) -> dict:
+    """
+    snapshot key -> full text index of the schedules that were searched before
+    """
+    search_indexes = _load_pickle(path)
+    return {} if search_indexes is None else search_indexes["indexes"]
+
+
+def save_search_indexes(path: Path, indexes: dict, used_keys: set) -> None:
+    """
+    Atomically replaces the full text indexes, those of no used snapshot key are dropped
+    """
+    _save_pickle(path, {
+        "version": SNAPSHOT_VERSION,
+        "indexes": {key: index for key, index in indexes.items() if key in used_keys},
+    })
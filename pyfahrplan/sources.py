@@ -0,0 +1,242 @@
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+import hashlib
+import json
+import mmap
+import os
+import sys
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from pyfahrplan.config import (
+    Colour,
+    config_defaults as cli_defaults,
+    conferences as builtin_conferences,
+)
+
+# entry point group of packages that add conferences, every entry point is a callable that
+# returns {acronym: location}
+ENTRY_POINT_GROUP = "pyfahrplan.sources"
+MIRROR_SUFFIX = ".schedule.json"
+# (config or entry point, message) that were reported already, the config is read more than
+# once per run
+_reported_configs = set()
+
+
+def config_path() -> Path:
+    """
+    $PYFAHRPLAN_CONFIG or $XDG_CONFIG_HOME/pyfahrplan/sources.json
+    """
+    if os.environ.get("PYFAHRPLAN_CONFIG"):
+        return Path(os.environ["PYFAHRPLAN_CONFIG"])
+    config_home = os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config"
+    return Path(config_home) / "pyfahrplan" / "sources.json"
+
+
+def read_config(path: Path = None) -> dict:
+    """
+    The sources config: {"conferences": {acronym: location}, "mirror": directory}, both optional
+
+    A location is an http(s) url, a file:// url or a path of a local everything.schedule.json.
+    A config that can't be read is reported and ignored.
+    """
+    path = config_path() if path is None else path
+    try:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        _report_config(path, f"Could not read the sources config {path}, ignoring it.", e)
+        return {}
+    if not isinstance(config, dict):
+        _report_config(path, f"The sources config {path} is no JSON object, ignoring it.")
+        return {}
+    config = dict(config)
+    if "conferences" in config and not _is_sources(config["conferences"]):
+        _report_config(
+            path,
+            f'"conferences" of the sources config {path} is no object of acronym -> location, '
+            "ignoring them.",
+        )
+        del config["conferences"]
+    if "mirror" in config and not isinstance(config["mirror"], str):
+        _report_config(path, f'"mirror" of the sources config {path} is no path, ignoring it.')
+        del config["mirror"]
+    return config
+
+
+def _is_sources(sources) -> bool:
+    return isinstance(sources, Mapping) and all(
+        isinstance(acronym, str) and isinstance(location, str)
+        for acronym, location in sources.items()
+    )
+
+
+def _report_config(source, message: str, error: Exception = None) -> None:
+    """
+    Prints message once per run, source is the config path or entry point that is broken
+    """
+    if (source, message) in _reported_configs:
+        return
+    _reported_configs.add((source, message))
+    print(f"{Colour.FAIL}{message}{Colour.ENDC}", file=sys.stderr)
+    if error is not None:
+        print(error, file=sys.stderr)
+
+
+@lru_cache(maxsize=None)
+def entry_point_sources() -> tuple:
+    """
+    (acronym, location) of the conferences installed packages add, they don't change at runtime
+    """
+    from importlib.metadata import entry_points
+
+    try:
+        found = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:  # python < 3.10
+        found = entry_points().get(ENTRY_POINT_GROUP, [])
+    sources = []
+    for entry_point in found:
+        # a broken plugin must not break pyfahrplan
+        name = f"The {ENTRY_POINT_GROUP} entry point {entry_point.name}"
+        try:
+            provided = entry_point.load()()
+        except Exception as e:
+            _report_config(entry_point.name, f"{name} failed, ignoring it.", e)
+            continue
+        if not _is_sources(provided):
+            _report_config(
+                entry_point.name,
+                f"{name} returned no mapping of acronym -> location, ignoring it.",
+            )
+            continue
+        sources.extend(provided.items())
+    return tuple(sources)
+
+
+def mirror_directory(config: dict = None) -> Path:
+    """
+    $PYFAHRPLAN_MIRROR or the mirror of the config, None if there is no mirror
+    """
+    config = read_config() if config is None else config
+    directory = os.environ.get("PYFAHRPLAN_MIRROR") or config.get("mirror")
+    return None if not directory else Path(directory).expanduser()
+
+
+def mirror_path(directory: Path, acronym: str) -> Path:
+    return Path(directory) / f"{acronym}{MIRROR_SUFFIX}"
+
+
+def load_sources(config: dict = None, use_mirror: bool = True) -> dict:
+    """
+    acronym -> location of every known conference
+
+    The built in conferences come first, then those of installed packages and of the config
+    file, later ones replace earlier ones with the same acronym. Conferences that have a file
+    in the mirror directory are read from there, unless use_mirror is False.
+    """
+    config = read_config() if config is None else config
+    sources = dict(builtin_conferences)
+    sources.update(entry_point_sources())
+    sources.update(config.get("conferences", {}))
+    directory = mirror_directory(config) if use_mirror else None
+    if directory is not None:
+        for acronym in sources:
+            if mirror_path(directory, acronym).is_file():
+                sources[acronym] = str(mirror_path(directory, acronym))
+    return sources
+
+
+def is_local(location: str) -> bool:
+    return urlparse(location).scheme not in ("http", "https")
+
+
+def local_path(location: str) -> Path:
+    url = urlparse(location)
+    return Path(unquote(url.path)) if url.scheme == "file" else Path(location).expanduser()
+
+
+@contextmanager
+def read_local(location: str):
+    """
+    The content of a local schedule as a read only memory map, valid inside the with block
+
+    Hashing and decoding read straight from the map, the file is never copied into a bytes
+    object first.
+    """
+    with open(local_path(location), "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:  # empty files can't be mapped
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            yield content
+
+
+def decode_schedule(content) -> dict:
+    """
+    Parses the bytes of a response or the memory map of a local file
+    """
+    if isinstance(content, (bytes, bytearray)):
+        return json.loads(content)
+    # str() decodes any buffer, json.loads only takes str, bytes and bytearray
+    return json.loads(str(content, "utf-8"))
+
+
+def _mirror_one(acronym: str, location: str, directory: Path, session) -> str:
+    target = mirror_path(directory, acronym)
+    if is_local(location):
+        if local_path(location).resolve() == target.resolve():
+            return "unchanged"
+        with read_local(location) as content:
+            return _write_if_changed(target, content)
+    response = session.get(location)
+    response.raise_for_status()
+    return _write_if_changed(target, response.content)
+
+
+def _write_if_changed(target: Path, content) -> str:
+    if target.is_file():
+        with read_local(str(target)) as old_content:
+            if hashlib.sha256(old_content).digest() == hashlib.sha256(content).digest():
+                return "unchanged"
+    # written next to the target and renamed, readers never see a half written file
+    tmp_target = target.with_name(f".{target.name}.tmp")
+    with open(tmp_target, "wb") as f:
+        f.write(content)
+    os.replace(tmp_target, target)
+    return "updated"
+
+
+def mirror(
+    sources: dict,
+    directory: Path,
+    max_workers: int = cli_defaults["max_workers"],
+    session=None,
+) -> dict:
+    """
+    Copies every source into directory/<acronym>.schedule.json in parallel
+
+    Returns acronym -> "updated", "unchanged" or the error. Files only change when the
+    schedule changed.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    if session is None:
+        import requests
+
+        session = requests.Session()
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            acronym: executor.submit(_mirror_one, acronym, location, directory, session)
+            for acronym, location in sources.items()
+        }
+        for acronym, future in futures.items():
+            try:
+                results[acronym] = future.result()
+            except (OSError, ValueError) as e:  # one broken source must not stop the others
+                results[acronym] = f"failed: {e}"
+    return results
@@ -0,0 +1,105 @@
+import json
+from json.decoder import JSONDecodeError
+import re
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def _skip_whitespace(text: str, i: int) -> int:
+    return _whitespace.match(text, i).end()
+
+
+def _expect(text: str, i: int, char: str) -> int:
+    i = _skip_whitespace(text, i)
+    if text[i:i + 1] != char:
+        raise JSONDecodeError(f"Expecting '{char}'", text, i)
+    return i + 1
+
+
+def _skip_value(text: str, i: int):
+    _, end = _decoder.raw_decode(text, _skip_whitespace(text, i))
+    return end
+    yield  # a generator like the other visitors
+
+
+def _walk_object(text: str, i: int, visit):
+    """
+    Walks the object at text[i], visit(key, i) is a generator that consumes the value at i,
+    yields whatever it finds and returns the end of the value
+    """
+    i = _expect(text, i, "{")
+    if text[_skip_whitespace(text, i)] == "}":
+        return _skip_whitespace(text, i) + 1
+    while True:
+        key, i = _decoder.raw_decode(text, _skip_whitespace(text, i))
+        i = _expect(text, i, ":")
+        i = yield from visit(key, i)
+        i = _skip_whitespace(text, i)
+        if text[i:i + 1] == ",":
+            i += 1
+        elif text[i:i + 1] == "}":
+            return i + 1
+        else:
+            raise JSONDecodeError("Expecting ',' delimiter", text, i)
+
+
+def _walk_array(text: str, i: int):
+    """
+    Yields the elements of the array at text[i] one by one and returns the end of the array
+    """
+    i = _expect(text, i, "[")
+    if text[_skip_whitespace(text, i)] == "]":
+        return _skip_whitespace(text, i) + 1
+    while True:
+        element, i = _decoder.raw_decode(text, _skip_whitespace(text, i))
+        yield element
+        i = _skip_whitespace(text, i)
+        if text[i:i + 1] == ",":
+            i += 1
+        elif text[i:i + 1] == "]":
+            return i + 1
+        else:
+            raise JSONDecodeError("Expecting ',' delimiter", text, i)
+
+
+def iter_schedule_days(text: str):
+    """
+    Yields (conference, day) for every day of an everything.schedule.json, one day at a time
+
+    conference holds the other keys of the conference that were read before the day, e.g. title
+    and acronym. Only one day is decoded at a time, the rest of the document stays text.
+    """
+    conference = {}
+    found_days = []
+
+    def visit_conference(key, i):
+        if key != "days":
+            conference[key], end = _decoder.raw_decode(text, _skip_whitespace(text, i))
+            return end
+        found_days.append(True)
+        days = _walk_array(text, i)
+        while True:
+            try:
+                day = next(days)
+            except StopIteration as stop:
+                return stop.value
+            yield conference, day
+
+    def visit_schedule(key, i):
+        if key == "conference":
+            return (yield from _walk_object(text, i, visit_conference))
+        return (yield from _skip_value(text, i))
+
+    def visit_root(key, i):
+        if key == "schedule":
+            return (yield from _walk_object(text, i, visit_schedule))
+        return (yield from _skip_value(text, i))
+
+    try:
+        yield from _walk_object(text, 0, visit_root)
+    except IndexError:
+        raise JSONDecodeError("Unexpected end of document", text, len(text)) from None
+    if not found_days:
+        # same error as schedule["conference"]["days"] on a decoded document
+        raise KeyError("days")
@@ -0,0 +1,167 @@
+from collections.abc import Mapping
+import datetime as dt
+from functools import lru_cache
+import sys
+
+from pyfahrplan.search import normalise
+
+TALK_FIELDS = (
+    "conference_title",
+    "conference_acronym",
+    "day",
+    "room",
+    "title",
+    "talk_guid",
+    "talk_id",
+    "talk_start",
+    "talk_date",
+    "talk_duration",
+    "talk_description",
+    "talk_abstract",
+    "track",
+    "speakers",
+)
+
+# these repeat for many talks, interning lets all talks share one string object
+INTERNED_FIELDS = (
+    "conference_title",
+    "conference_acronym",
+    "room",
+    "talk_start",
+    "talk_duration",
+    "track",
+)
+
+# parsed once when a talk is created, they are not part of the dict view of a talk. They are all
+# None for a talk whose start, date or duration can't be parsed, the time filters skip it.
+TIME_FIELDS = (
+    "start_minute",  # minute of the day talk_start is at
+    "duration_minutes",
+    "start_epoch",
+    "end_epoch",
+)
+
+_FIELD_SET = frozenset(TALK_FIELDS)
+
+
+def person_key(person: dict, conference_acronym: str) -> str:
+    """
+    Identifies a person across conferences
+
+    The congresses up to rc3 share one frab, so its ids stay the same over the years. But the
+    everything schedules also merge in the stages with their own numbering, where the same id
+    is used for several people, so a frab id only identifies a person together with the name.
+    pretalx (rc3-2021 and later) has a code per event instead.
+    """
+    if person.get("guid"):
+        return person["guid"]
+    if person.get("code"):
+        return f"{conference_acronym}:{person['code']}"
+    name = " ".join(normalise(person_name(person) or "").split())
+    if person.get("id") is not None:
+        return f"frab:{person['id']}:{name}"
+    return f"name:{name}"
+
+
+def person_name(person: dict) -> str:
+    return person.get("public_name", person.get("full_public_name", ""))
+
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=1024)
+def parse_clock(value: str) -> int:
+    """
+    "HH:MM" to minutes, used for the time of day as well as for durations
+    """
+    try:
+        hours, minutes = value.split(":")
+        return int(hours) * 60 + int(minutes)
+    except ValueError:
+        from dateutil.parser import parse
+
+        time = parse(value)
+        return time.hour * 60 + time.minute
+
+
+def parse_talk_date(value: str) -> dt.datetime:
+    try:
+        return dt.datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil.parser import parse
+
+        return parse(value)
+
+
+def talk_times(talk_start: str, talk_date: str, talk_duration: str) -> tuple:
+    """
+    Values of TIME_FIELDS for a talk, all None if one of them can't be parsed
+    """
+    try:
+        start_minute = parse_clock(talk_start)
+        duration_minutes = parse_clock(talk_duration)
+        start_epoch = parse_talk_date(talk_date).timestamp()
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        # e.g. a duration of "TBD" or null, one broken talk must not break the whole schedule
+        return None, None, None, None
+    return start_minute, duration_minutes, start_epoch, start_epoch + duration_minutes * 60
+
+
+class Talk(Mapping):
+    """
+    One flattened talk
+
+    Uses slots instead of a dict per talk, but still behaves like the read-only dict that
+    flatten_fahrplans used to produce, so talk["title"] and talk.get("title") keep working.
+    """
+
+    # persons is a tuple of (person_key, name), like the time fields it is not part of the dict
+    __slots__ = TALK_FIELDS + TIME_FIELDS + ("persons",)
+
+    def __init__(self, *values, persons: tuple = ()):
+        """
+        Takes the values of TALK_FIELDS, optionally followed by the already parsed TIME_FIELDS
+        """
+        self.persons = persons
+        for field, value in zip(TALK_FIELDS, values):
+            setattr(self, field, value)
+        if len(values) > len(TALK_FIELDS):
+            times = values[len(TALK_FIELDS):]
+        else:
+            times = talk_times(self.talk_start, self.talk_date, self.talk_duration)
+        for field, value in zip(TIME_FIELDS, times):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_dict(cls, talk: dict) -> "Talk":
+        return cls(*(talk.get(field) for field in TALK_FIELDS))
+
+    def __getitem__(self, key):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in _FIELD_SET else default
+
+    def __iter__(self):
+        return iter(TALK_FIELDS)
+
+    def __len__(self):
+        return len(TALK_FIELDS)
+
+    def __reduce__(self):
+        values = tuple(getattr(self, field) for field in TALK_FIELDS + TIME_FIELDS)
+        return _restore_talk, (values, self.persons)
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in TALK_FIELDS}
+
+    def __repr__(self):
+        return f"Talk({self.as_dict()!r})"
+
+
+def _restore_talk(values: tuple, persons: tuple) -> Talk:
+    return Talk(*values, persons=persons)
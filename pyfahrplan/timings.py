@@ -0,0 +1,175 @@
+import threading
+import time
+
+
+class _Stage:
+    __slots__ = ("timings", "name", "talks", "begin")
+
+    def __init__(self, timings: "Timings", name: str, talks: int):
+        self.timings = timings
+        self.name = name
+        self.talks = talks
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, time.perf_counter() - self.begin, talks=self.talks)
+        return False
+
+
+class _NoStage:
+    """
+    What stage() returns while timings are disabled, entering and leaving it does nothing
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def talks(self):
+        return 0
+
+    @talks.setter
+    def talks(self, value):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+class Timings:
+    """
+    Wall time, calls and talks per stage plus cache information per downloaded url
+
+    Stages can be recorded from several threads (the downloads run in parallel), so the seconds
+    of a stage are the sum over all threads, not the wall time of the whole run.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        # name -> {"seconds", "calls", "talks"}, in the order the stages first ran
+        self.stages = {}
+        # url -> {"from_cache", "snapshot", "bytes", "seconds"}
+        self.urls = {}
+
+    def stage(self, name: str, talks: int = 0) -> _Stage:
+        """
+        Context manager that adds its wall time to name, set .talks to record a talk count
+        """
+        return _Stage(self, name, talks)
+
+    def add(self, name: str, seconds: float, calls: int = 1, talks: int = 0) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "talks": 0})
+            stage["seconds"] += seconds
+            stage["calls"] += calls
+            stage["talks"] += talks
+
+    def count(self, name: str, talks):
+        """
+        Passes talks through and adds their number to name once they are consumed
+
+        The time between two talks belongs to the consumer, so only the talks are counted.
+        """
+        counted = 0
+        try:
+            for talk in talks:
+                counted += 1
+                yield talk
+        finally:
+            self.add(name, 0.0, calls=0, talks=counted)
+
+    def url(self, url: str, from_cache: bool, snapshot: bool, size: int, seconds: float) -> None:
+        with self._lock:
+            self.urls[url] = {
+                "from_cache": from_cache,
+                "snapshot": snapshot,
+                "bytes": size,
+                "seconds": seconds,
+            }
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "total_seconds": time.perf_counter() - self.started,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "urls": {url: dict(info) for url, info in self.urls.items()},
+            }
+
+    def format(self) -> str:
+        timings = self.as_dict()
+        lines = [f"{'stage':24} {'ms':>10} {'calls':>8} {'talks':>9}"]
+        for name, stage in timings["stages"].items():
+            lines.append(
+                f"{name:24} {stage['seconds'] * 1000:10.1f} {stage['calls']:8} {stage['talks']:9}"
+            )
+        lines.append(f"{'total':24} {timings['total_seconds'] * 1000:10.1f}")
+        if timings["urls"]:
+            cache_hits = sum(info["from_cache"] for info in timings["urls"].values())
+            lines.append(
+                f"\n{len(timings['urls'])} urls, {cache_hits} from the http cache, "
+                f"{sum(info['bytes'] for info in timings['urls'].values())} bytes"
+            )
+            for url, info in timings["urls"].items():
+                source = "cache" if info["from_cache"] else "network"
+                if info["snapshot"]:
+                    source += "+snapshot"
+                lines.append(
+                    f"  {info['seconds'] * 1000:8.1f} ms {info['bytes']:10} bytes {source:15} {url}"
+                )
+        return "\n".join(lines)
+
+
+class DisabledTimings:
+    """
+    Records nothing, the default, so the instrumented code costs one attribute check per stage
+    """
+
+    enabled = False
+
+    def stage(self, name: str, talks: int = 0) -> _NoStage:
+        return _NO_STAGE
+
+    def add(self, name: str, seconds: float, calls: int = 1, talks: int = 0) -> None:
+        pass
+
+    def count(self, name: str, talks):
+        return talks
+
+    def url(self, url: str, from_cache: bool, snapshot: bool, size: int, seconds: float) -> None:
+        pass
+
+
+DISABLED = DisabledTimings()
+_current = DISABLED
+
+
+def current():
+    """
+    The active Timings, or DISABLED
+    """
+    return _current
+
+
+def enable() -> Timings:
+    """
+    Starts recording into a fresh Timings and returns it
+    """
+    global _current
+    _current = Timings()
+    return _current
+
+
+def disable() -> None:
+    global _current
+    _current = DISABLED
@@ -0,0 +1,209 @@
+"""
+Benchmarks of loading, filtering, sorting and rendering synthetic schedules
+
+Runs offline, every known conference url is answered by requests_mock with a synthetic schedule.
+
+    python -m tests.benchmark                     # compare against the stored baselines
+    python -m tests.benchmark --talks 100000      # only one size
+    python -m tests.benchmark --update-baselines  # store the current timings as baselines
+"""
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+from pathlib import Path
+import os
+import sys
+import tempfile
+import time
+
+import requests_mock
+
+from pyfahrplan import lib
+from pyfahrplan.config import conferences as cli_conferences
+from pyfahrplan.index import TimeIndex
+from pyfahrplan.lib import (
+    Fahrplan,
+    Query,
+    filter_talk,
+    flatten_fahrplan,
+    is_talk_in_timerange,
+    print_formatted_talks,
+    select_talks,
+    stream_talks,
+)
+from .synthetic import generate_schedule
+
+script_dir = Path(os.path.dirname(os.path.realpath(__file__)))
+baselines_file = script_dir / "data" / "benchmark_baselines.json"
+
+SIZES = (1000, 10000, 100000)
+# a stage is a regression if it takes longer than TOLERANCE times its baseline
+TOLERANCE = 2.0
+# stages faster than this are too noisy to compare
+MIN_SECONDS = 0.005
+
+# the synthetic schedules start on 2030-12-27 10:00 +01:00
+NOW = dt.datetime(2030, 12, 28, 15, 0, tzinfo=dt.timezone(dt.timedelta(hours=1)))
+FILTERS = {
+    "speaker": {"speaker": "ka"},
+    "title": {"title": "privacy"},
+    "track": {"track": "security"},
+    "day": {"day": 2},
+    "start": {"start": "14:00"},
+    "room": {"room": "room b"},
+    "conference": {"conference": "34c3"},
+    "no_past": {"filter_past": True},
+}
+# rich tables are slow and nobody reads 100k rows, the table is rendered for the first talks only
+TABLE_ROWS = 500
+
+
+def synthetic_documents(talks: int, days: int = 4, rooms: int = 8, text_size: int = 50) -> dict:
+    """
+    url -> serialised synthetic schedule, the talks are split over all known conferences
+    """
+    documents = {}
+    for seed, (acronym, url) in enumerate(cli_conferences.items()):
+        schedule = generate_schedule(
+            acronym=acronym,
+            days=days,
+            rooms=rooms,
+            talks=talks // len(cli_conferences) + (seed < talks % len(cli_conferences)),
+            speakers=max(1, talks // 4),
+            text_size=text_size,
+            seed=seed,
+        )
+        documents[url] = json.dumps(schedule)
+    return documents
+
+
+def _best_of(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - begin)
+    return min(timings)
+
+
+def run_benchmarks(talks: int, repeat: int = 3) -> dict:
+    """
+    stage -> best wall time in seconds of the given number of synthetic talks
+    """
+    documents = synthetic_documents(talks)
+    parsed = [json.loads(document)["schedule"] for document in documents.values()]
+    results = {}
+    snapshot_file = lib.snapshot_file
+    with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as tmp_dir:
+        for url, document in documents.items():
+            m.get(url, text=document)
+
+        results["load"] = _best_of(lambda: Fahrplan(use_cache=False, use_snapshot=False), repeat)
+        lib.snapshot_file = Path(tmp_dir) / "snapshot.pickle"
+        try:
+            Fahrplan(use_cache=False)  # writes the snapshot
+            results["load_snapshot"] = _best_of(lambda: Fahrplan(use_cache=False), repeat)
+        finally:
+            lib.snapshot_file = snapshot_file
+        results["stream"] = _best_of(
+            lambda: sum(1 for _ in stream_talks(use_cache=False)), repeat
+        )
+        fahrplan = Fahrplan(use_cache=False, use_snapshot=False)
+
+    talks = fahrplan.flat_plans
+    results["flatten"] = _best_of(lambda: [flatten_fahrplan(schedule) for schedule in parsed], repeat)
+    for name, arguments in FILTERS.items():
+        query = Query(now=NOW, **arguments)
+        results[f"filter_{name}"] = _best_of(lambda: query.filter(talks), repeat)
+    results["filter_talk"] = _best_of(
+        lambda: [talk for talk in talks if filter_talk(talk, speaker="ka", now=NOW)], repeat
+    )
+    results["is_talk_in_timerange"] = _best_of(
+        lambda: [talk for talk in talks if is_talk_in_timerange(talk, "14:00")], repeat
+    )
+    results["time_index"] = _best_of(lambda: TimeIndex(talks).in_timerange("14:00"), repeat)
+    results["search_index"] = _best_of(fahrplan.build_indexes, 1)
+    results["search"] = _best_of(lambda: fahrplan.search("privacy surveillance", 20), repeat)
+    results["sort"] = _best_of(lambda: select_talks(talks, "title"), repeat)
+    results["sort_limit"] = _best_of(lambda: select_talks(talks, "title", limit=20), repeat)
+    for output_format in ("jsonl", "csv"):
+        results[f"render_{output_format}"] = _best_of(
+            lambda: _render(talks, output_format), repeat
+        )
+    results["render_table"] = _best_of(lambda: _render(talks[:TABLE_ROWS], "table"), repeat)
+    return results
+
+
+def _render(talks: list, output_format: str) -> None:
+    with contextlib.redirect_stdout(io.StringIO()):
+        print_formatted_talks(talks, False, False, None, False, output_format)
+
+
+def load_baselines(path: Path = baselines_file) -> dict:
+    """
+    str(talks) -> stage -> seconds
+    """
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(baselines: dict, path: Path = baselines_file) -> None:
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(results: dict, baselines: dict, tolerance: float = TOLERANCE) -> list:
+    """
+    Messages for every stage that took more than tolerance times its baseline
+    """
+    regressions = []
+    for stage, seconds in results.items():
+        baseline = baselines.get(stage)
+        if baseline is None:
+            continue
+        if seconds > MIN_SECONDS and seconds > tolerance * baseline:
+            regressions.append(
+                f"{stage}: {seconds * 1000:.1f} ms, baseline {baseline * 1000:.1f} ms"
+            )
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--talks", type=int, action="append", help="number of talks (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best counts")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--update-baselines", action="store_true")
+    arguments = parser.parse_args(argv)
+
+    baselines = load_baselines()
+    regressions = []
+    for talks in arguments.talks or SIZES:
+        results = run_benchmarks(talks, arguments.repeat)
+        baseline = baselines.get(str(talks), {})
+        print(f"{talks} talks")
+        for stage, seconds in results.items():
+            compared = f"  (baseline {baseline[stage] * 1000:9.1f} ms)" if stage in baseline else ""
+            print(f"  {stage:22} {seconds * 1000:9.1f} ms{compared}")
+        if arguments.update_baselines:
+            baselines[str(talks)] = {stage: round(seconds, 6) for stage, seconds in results.items()}
+        else:
+            regressions.extend(
+                f"{talks} talks, {message}"
+                for message in find_regressions(results, baseline, arguments.tolerance)
+            )
+    if arguments.update_baselines:
+        save_baselines(baselines)
+        print(f"Baselines written to {baselines_file}")
+    for message in regressions:
+        print(f"Regression: {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
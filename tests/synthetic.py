@@ -0,0 +1,112 @@
+"""
+Generator for synthetic everything.schedule.json documents, e.g. for the benchmarks
+"""
+import datetime as dt
+import random
+import uuid
+
+WORDS = (
+    "hacking privacy security network freedom surveillance encryption hardware software "
+    "open source community chaos congress infrastructure protocol radio satellite firmware "
+    "exploit kernel browser election democracy climate energy mobility data protection "
+    "überwachung datenschutz sicherheit netzpolitik freiheit grundrechte öffentlichkeit "
+    "straße gesellschaft küche bürger rechte überblick"
+).split()
+SYLLABLES = "an bel cor da el fi go ha ix jo ka li mo nu or pi qu ra si tu ul vi wo xa yo zu".split()
+TRACKS = ("Security", "Ethics, Society & Politics", "Hardware & Making", "Art & Culture", "CCC", "Science")
+DURATIONS = ("00:30", "0:40", "01:00", "1:30")
+
+
+def _name(rng: random.Random) -> str:
+    return " ".join(
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        for _ in range(rng.randint(1, 2))
+    )
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate_schedule(
+    acronym: str = "synth",
+    days: int = 4,
+    rooms: int = 5,
+    talks: int = 1000,
+    speakers: int = 500,
+    text_size: int = 50,
+    seed: int = 0,
+) -> dict:
+    """
+    A schedule with the given number of talks, spread evenly over days and rooms
+
+    text_size is the number of words of an abstract, descriptions are twice as long.
+    """
+    rng = random.Random(seed)
+    people = [{"id": 1000 + i, "public_name": _name(rng)} for i in range(speakers)]
+    room_names = [f"Room {chr(ord('A') + i % 26)}{i // 26 or ''}" for i in range(rooms)]
+    first_day = dt.datetime(2030, 12, 27, tzinfo=dt.timezone(dt.timedelta(hours=1)))
+    talks_per_slot = [talks // (days * rooms)] * (days * rooms)
+    for i in range(talks % (days * rooms)):
+        talks_per_slot[i] += 1
+
+    schedule_days = []
+    talk_id = 1
+    for day_index in range(days):
+        day_start = first_day + dt.timedelta(days=day_index, hours=10)
+        day_rooms = {}
+        for room_index, room_name in enumerate(room_names):
+            start = day_start
+            room_talks = []
+            for _ in range(talks_per_slot[day_index * rooms + room_index]):
+                duration = rng.choice(DURATIONS)
+                hours, minutes = duration.split(":")
+                room_talks.append({
+                    "id": talk_id,
+                    "guid": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "logo": None,
+                    "date": start.isoformat(),
+                    "start": start.strftime("%H:%M"),
+                    "duration": duration,
+                    "room": room_name,
+                    "slug": f"{acronym}-{talk_id}",
+                    "url": f"https://example.org/{acronym}/talk/{talk_id}",
+                    "title": _text(rng, rng.randint(2, 8)).title(),
+                    "subtitle": "",
+                    "track": rng.choice(TRACKS),
+                    "type": "lecture",
+                    "language": rng.choice(("en", "de")),
+                    "abstract": _text(rng, text_size),
+                    "description": _text(rng, 2 * text_size),
+                    "recording_license": "",
+                    "do_not_record": False,
+                    "persons": rng.sample(people, min(len(people), rng.randint(1, 3))),
+                    "links": [],
+                    "attachments": [],
+                })
+                talk_id += 1
+                start += dt.timedelta(hours=int(hours), minutes=int(minutes) + 15)
+            day_rooms[room_name] = room_talks
+        schedule_days.append({
+            "index": day_index,
+            "date": day_start.date().isoformat(),
+            "day_start": day_start.isoformat(),
+            "day_end": (day_start + dt.timedelta(hours=18)).isoformat(),
+            "rooms": day_rooms,
+        })
+
+    return {
+        "schedule": {
+            "version": f"synthetic {seed}",
+            "base_url": "https://example.org/",
+            "conference": {
+                "acronym": acronym,
+                "title": f"Synthetic Congress {acronym}",
+                "start": first_day.date().isoformat(),
+                "end": (first_day + dt.timedelta(days=days - 1)).date().isoformat(),
+                "daysCount": days,
+                "timeslot_duration": "00:15",
+                "days": schedule_days,
+            },
+        }
+    }
@@ -1,37 +1,91 @@
+from collections import defaultdict
+import csv
+import datetime as dt
 from functools import wraps
+from itertools import combinations
 import json
 from pathlib import Path
 import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
 
+from click.testing import CliRunner
+import pytest
 import requests_mock
 
 from pyfahrplan import __version__
-from pyfahrplan.lib import Fahrplan, filter_talk
+from pyfahrplan import lib
+from pyfahrplan.config import conferences_matching
+from pyfahrplan.lib import (
+    Fahrplan,
+    Query,
+    filter_talk,
+    is_talk_in_past,
+    is_talk_in_timerange,
+    select_talks,
+    stream_talks,
+)
+from pyfahrplan.pyfahrplan_cli import cli
+from pyfahrplan.batch import read_specs, run_batch
+from pyfahrplan.search import tokenise
+from pyfahrplan.client import query_server
+from pyfahrplan.server import FahrplanServer
+from pyfahrplan.stream import iter_schedule_days
+from pyfahrplan.talk import Talk
+from pyfahrplan.timings import current as current_timings
+from .benchmark import find_regressions, load_baselines, run_benchmarks, synthetic_documents
 from .data.test_data import test_flat_talks
+from .synthetic import generate_schedule
 
 script_dir = Path(os.path.dirname(os.path.realpath(__file__)))
 data_dir = script_dir / "data"
 
 
+def register_fahrplans(m):
+    for c3 in range(32, 37):
+        json_file = Path(f"{c3}.json")
+        fahrplan_data = json.load(open(data_dir / json_file, "r"))
+        m.get(
+            f"https://raw.githubusercontent.com/voc/{c3}C3_schedule/master/everything.schedule.json",
+            text=json.dumps(fahrplan_data),
+        )
+    for rc3 in ["rC3", "rC3_21"]:
+        json_file = Path(f"{rc3.lower()}.json")
+        rc3_data = json.load(open(data_dir / json_file, "r"))
+        m.get(
+            f"https://data.c3voc.de/{rc3.lower()}/everything.schedule.json",
+            text=json.dumps(rc3_data),
+        )
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """
+    Every test gets its own http cache and snapshot, the ones next to the package are never
+    touched by the mocked fahrplans and never leak into the tests. Neither do the sources
+    config, mirror and plugins of the developer.
+    """
+    from pyfahrplan import sources
+
+    monkeypatch.setattr(lib, "cache_file", tmp_path / "schedule_cache.sqlite")
+    monkeypatch.setattr(lib, "snapshot_file", tmp_path / "fahrplan_snapshot.pickle")
+    monkeypatch.setattr(lib, "search_file", tmp_path / "fahrplan_search.pickle")
+    monkeypatch.setenv("PYFAHRPLAN_CONFIG", str(tmp_path / "missing_sources.json"))
+    monkeypatch.delenv("PYFAHRPLAN_MIRROR", raising=False)
+    monkeypatch.setattr(sources, "_reported_configs", set())
+    sources.entry_point_sources.cache_clear()
+    yield
+    sources.entry_point_sources.cache_clear()
+
+
 def mock_requests(func):
     @wraps(func)
     def function_wrapper():
         with requests_mock.Mocker() as m:
-            for c3 in range(32, 37):
-                json_file = Path(f"{c3}.json")
-                fahrplan_data = json.load(open(data_dir / json_file, "r"))
-                m.get(
-                    f"https://raw.githubusercontent.com/voc/{c3}C3_schedule/master/everything.schedule.json",
-                    text=json.dumps(fahrplan_data),
-                )
-            for rc3 in ["rC3", "rC3_21"]:
-                json_file = Path(f"{rc3.lower()}.json")
-                rc3_data = json.load(open(data_dir / json_file, "r"))
-                m.get(
-                    f"https://data.c3voc.de/{rc3.lower()}/everything.schedule.json",
-                    text=json.dumps(rc3_data),
-                )
-
+            register_fahrplans(m)
             return func()
 
     return function_wrapper
@@ -47,6 +101,595 @@ def test_fahrplan_initialization():
     assert len(fahrplan.flat_plans) > 0
 
 
+def test_fahrplan_download_failure_does_not_abort_others():
+    broken_url = "https://raw.githubusercontent.com/voc/33C3_schedule/master/everything.schedule.json"
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        m.get(broken_url, status_code=500)
+        fahrplan = Fahrplan(max_workers=2, use_snapshot=False, use_cache=False)
+    acronyms = {talk["conference_acronym"] for talk in fahrplan.flat_plans}
+    assert len(fahrplan.fahrplans) == len(fahrplan.urls) - 1
+    assert "33c3" not in acronyms and "32c3" in acronyms
+
+
+def test_fahrplan_snapshot():
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        fahrplan = Fahrplan()
+        snapshotted_fahrplan = Fahrplan()
+    assert len(fahrplan.fahrplans) == len(fahrplan.urls)
+    # nothing changed, so nothing is parsed or flattened again
+    assert snapshotted_fahrplan.fahrplans == []
+    assert snapshotted_fahrplan.flat_plans == fahrplan.flat_plans
+
+
+def test_talk_behaves_like_a_dict():
+    talk = Talk.from_dict(test_flat_talks[0])
+    assert talk == test_flat_talks[0]
+    assert talk.as_dict() == test_flat_talks[0]
+    assert talk["speakers"] == talk.get("speakers") == "Carina Haupt, Linus Neumann"
+    assert talk.get("no_such_field", "") == ""
+    assert "title" in talk and "no_such_field" not in talk
+    assert filter_talk(talk, conference="32c3", speaker="CaRiNa", room="Hall 1")
+    with pytest.raises(KeyError):
+        talk["no_such_field"]
+
+
+def test_conferences_matching():
+    assert conferences_matching("all") == ["32c3", "33c3", "34c3", "35c3", "36c3", "rc3", "rc3-2021"]
+    assert conferences_matching("RC3") == ["rc3", "rc3-2021"]
+    assert conferences_matching("2021") == ["rc3-2021"]
+    assert conferences_matching("37c3") == []
+    # no matching conference is an empty result, not a download failure
+    result = CliRunner().invoke(cli, ["-c", "37c3", "--no-server"])
+    assert result.exit_code == 0 and result.output == "No talks in this period.\n"
+
+
+def test_fahrplan_lazy_conference_loading():
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        fahrplan = Fahrplan(conferences=["rc3-2021"], use_snapshot=False, use_cache=False)
+        assert m.call_count == 1
+        assert {talk["conference_acronym"] for talk in fahrplan.flat_plans} == {"rc3-2021"}
+        fahrplan.load(["rc3-2021", "32c3"])
+        assert m.call_count == 2
+    assert fahrplan.conferences == ["rc3-2021", "32c3"]
+    assert {talk["conference_acronym"] for talk in fahrplan.flat_plans} == {"rc3-2021", "32c3"}
+
+
+@mock_requests
+def test_time_index_matches_filters():
+    fahrplan = Fahrplan(conferences=["36c3", "rc3-2021"])
+    for start in ["0:0", "2:12", "11:0", "13:37", "23:59"]:
+        expected = [talk for talk in fahrplan.flat_plans if is_talk_in_timerange(talk, start)]
+        assert fahrplan.talks_in_timerange(start) == expected
+    now = dt.datetime(2021, 12, 28, 14, 0).astimezone()
+    expected = [talk for talk in fahrplan.flat_plans if not is_talk_in_past(talk, now)]
+    assert fahrplan.talks_not_past(now) == expected
+
+
+def test_broken_talk_times():
+    url = "https://example.org/37c3/everything.schedule.json"
+    schedule = generate_schedule("37c3", days=1, rooms=2, talks=10)
+    room_a, room_b = schedule["schedule"]["conference"]["days"][0]["rooms"].values()
+    room_a[0]["duration"] = "TBD"
+    room_a[1]["duration"] = None
+    room_b[0]["date"] = ""
+    Path(os.environ["PYFAHRPLAN_CONFIG"]).write_text(json.dumps({"conferences": {"37c3": url}}))
+    with requests_mock.Mocker() as m:
+        m.get(url, text=json.dumps(schedule))
+        fahrplan = Fahrplan(conferences=["37c3"], use_cache=False)
+        streamed = list(stream_talks(["37c3"], use_cache=False))
+        snapshotted = Fahrplan(conferences=["37c3"], use_cache=False)
+    # the talks are kept, just without times
+    assert len(fahrplan.flat_plans) == len(streamed) == 10
+    broken = [talk for talk in fahrplan.flat_plans if talk.start_epoch is None]
+    assert [talk["talk_id"] for talk in broken] == [room_a[0]["id"], room_a[1]["id"], room_b[0]["id"]]
+    assert snapshotted.flat_plans == fahrplan.flat_plans
+    # the time filters skip them, with and without indexes
+    now = dt.datetime(2030, 12, 27, 11, 0).astimezone()
+    for query in (Query(start="10:00"), Query(filter_past=True, now=now)):
+        assert fahrplan.query(query) == query.filter(fahrplan.flat_plans)
+        assert not set(map(id, broken)) & set(map(id, fahrplan.query(query)))
+    assert fahrplan.now_and_next(now)
+    assert fahrplan.interval_index.parallel_to(fahrplan.flat_plans.index(broken[0])) == []
+    assert fahrplan.interval_index.room_conflicts() == []
+
+
+@mock_requests
+def test_substring_index_matches_filter_talk():
+    fahrplan = Fahrplan(conferences=["35c3", "36c3"], use_indexes=True)
+    for filters in [
+        {"speaker": "a"},
+        {"speaker": "RIXX"},
+        {"title": "opening"},
+        {"title": "Ö"},
+        {"track": "Security", "room": "Hall"},
+        {"room": "Dijkstra", "title": ""},
+        {"title": "no such talk at all"},
+    ]:
+        expected = [talk for talk in fahrplan.flat_plans if filter_talk(talk, **filters)]
+        # candidates are verified with an exact substring match already
+        assert fahrplan.candidates(**filters) == expected
+
+
+def test_tokenise():
+    assert tokenise("Über die Überwachung im Café an der Straße") == ["ueberwachung", "cafe", "strasse"]
+    assert tokenise("The Privacy of C") == ["privacy"]
+
+
+def test_fahrplan_search():
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        fahrplan = Fahrplan(conferences=["34c3", "rc3-2021"])
+        results = fahrplan.search("ueberwachung", limit=3)
+        assert len(results) == 3
+        assert all("berwachung" in (talk["title"] + talk["talk_abstract"]).lower() for talk in results)
+        assert fahrplan.search("Überwachung") == fahrplan.search("ueberwachung")
+        only_rc3 = fahrplan.search("Überwachung", accept=lambda talk: talk["conference_acronym"] == "rc3-2021")
+        assert only_rc3 and {talk["conference_acronym"] for talk in only_rc3} == {"rc3-2021"}
+        assert fahrplan.search("the of and") == []
+        # the full text indexes are kept next to the snapshot and only loaded by a search
+        snapshotted_fahrplan = Fahrplan(conferences=["34c3", "rc3-2021"])
+        assert snapshotted_fahrplan._search is None
+        assert snapshotted_fahrplan.search("ueberwachung", limit=3) == results
+        assert len(snapshotted_fahrplan._search) == 2
+
+
+@mock_requests
+def test_person_index():
+    fahrplan = Fahrplan(conferences=conferences_matching("c3"), use_snapshot=False, use_cache=False)
+    (key, name, talks), = [person for person in fahrplan.people("LINUS neumann") if len(person[2]) > 1]
+    assert name == "Linus Neumann"
+    assert {talk["conference_acronym"] for talk in talks} == {"32c3", "33c3", "34c3", "35c3", "36c3"}
+    assert fahrplan.talks_by_person(key) == talks
+    names = [person[1] for person in fahrplan.people("stähl", prefix=True)]
+    assert names and names == [person[1] for person in fahrplan.people("Stahlin")]
+    for speaker_match in ("exact", "prefix"):
+        query = Query(speaker="ann", conference="36c3", speaker_match=speaker_match)
+        # the person index finds the same talks as the predicate
+        assert fahrplan.query(query) == query.filter(fahrplan.flat_plans)
+    exact = fahrplan.query(Query(speaker="ann", conference="36c3", speaker_match="exact"))
+    assert exact and all("Ann" in [name for _, name in talk.persons] for talk in exact)
+    # "ann" is a substring of "Joanna" and "Hannes", but not one of their names
+    assert len(fahrplan.query(Query(speaker="ann", conference="36c3"))) > len(exact)
+
+
+@mock_requests
+def test_overlaps():
+    fahrplan = Fahrplan(conferences=["36c3"])
+    talks = fahrplan.flat_plans
+
+    def overlap(talk, other):
+        return talk.start_epoch < other.end_epoch and other.start_epoch < talk.end_epoch
+
+    rooms = defaultdict(list)
+    for position, talk in enumerate(talks):
+        rooms[talk.room].append((talk.start_epoch, position))
+    expected = {
+        (a, b)
+        for room in rooms.values()
+        for (_, a), (_, b) in combinations(sorted(room), 2)
+        if overlap(talks[a], talks[b])
+    }
+    positions = {id(talk): position for position, talk in enumerate(talks)}
+    assert {(positions[id(a)], positions[id(b)]) for a, b in fahrplan.room_conflicts()} == expected
+    opening = talks[fahrplan.positions_of([10496])[0]]
+    parallel = fahrplan.parallel_talks("10496")
+    assert parallel == [talk for talk in talks if talk is not opening and overlap(talk, opening)]
+    agenda = [opening["talk_guid"], parallel[0]["talk_id"], parallel[-1]["talk_id"], 999999]
+    clashes = fahrplan.agenda_conflicts(agenda)
+    assert clashes and all(overlap(talk, other) for talk, other in clashes)
+    assert (opening, parallel[0]) in clashes and (opening, parallel[-1]) in clashes
+    assert len(fahrplan.agenda_conflicts(agenda, only_agenda=False)) > len(clashes)
+
+
+@mock_requests
+def test_now_and_next():
+    fahrplan = Fahrplan(conferences=["rc3-2021"])
+    now = dt.datetime.fromisoformat("2021-12-27T11:10:00+01:00")
+    talks = fahrplan.now_and_next(now)
+    running = [talk for talk in talks if talk.start_epoch <= now.timestamp() <= talk.end_epoch]
+    assert "Opening" in [talk["title"] for talk in running]
+    upcoming = [talk for talk in talks if talk.start_epoch > now.timestamp()]
+    rooms = [talk["room"] for talk in upcoming]
+    assert len(rooms) == len(set(rooms))
+
+
+def test_query_drops_default_filters():
+    assert Query().predicates == []
+    assert len(Query(speaker="carina", day=0, room="all").predicates) == 2
+
+
+@mock_requests
+def test_query_matches_filter_talk():
+    fahrplan = Fahrplan(conferences=["36c3", "rc3-2021"])
+    now = dt.datetime(2021, 12, 28, 14, 0).astimezone()
+    for filters in [
+        {},
+        {"conference": "36c3", "day": 2},
+        {"speaker": "a", "track": "security"},
+        {"start": "14:30", "room": "hall"},
+        {"filter_past": True, "title": "the"},
+    ]:
+        expected = [talk for talk in fahrplan.flat_plans if filter_talk(talk, now=now, **filters)]
+        query = Query(now=now, **filters)
+        assert query.filter(fahrplan.flat_plans) == expected
+        assert fahrplan.query(query) == expected
+
+
+def test_iter_schedule_days():
+    text = open(data_dir / "rc3_21.json").read()
+    days = list(iter_schedule_days(text))
+    assert [day for _, day in days] == json.loads(text)["schedule"]["conference"]["days"]
+    assert days[0][0]["acronym"] == "rc3-2021"
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_schedule_days(text[:len(text) // 2]))
+    with pytest.raises(KeyError):
+        list(iter_schedule_days('{"version": "1"}'))
+
+
+@mock_requests
+def test_stream_talks():
+    fahrplan = Fahrplan(conferences=["32c3", "rc3"], use_snapshot=False)
+    streamed_talks = stream_talks(["32c3", "rc3"])
+    assert not isinstance(streamed_talks, list)
+    assert list(streamed_talks) == fahrplan.flat_plans
+    query = Query(speaker="carina", conference="32c3")
+    assert list(query.iter_filter(stream_talks(["32c3"]))) == query.filter(fahrplan.flat_plans)
+
+
+@mock_requests
+def test_server():
+    from urllib.error import HTTPError
+    from urllib.request import urlopen
+
+    def fahrplan_factory():
+        return Fahrplan(conferences=["35c3", "rc3-2021"])
+
+    server = FahrplanServer(("127.0.0.1", 0), fahrplan_factory, refresh_interval=3600)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        talks = query_server({"speaker": "rixx", "conference": "35c3", "no_past": False}, port=port)
+        expected = server.fahrplan.find(Query(speaker="rixx", conference="35c3"))
+        assert talks == [talk.as_dict() for talk in expected] and talks
+        searched = query_server({"search": "ueberwachung", "limit": 2}, port=port)
+        assert len(searched) == 2
+        assert query_server({"day": "monday"}, port=port) is None
+        with pytest.raises(HTTPError) as error:
+            urlopen(f"http://127.0.0.1:{port}/talks?speaker=rixx&speaker_match=fuzzy")
+        assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert query_server({}, port=port) is None
+
+
+def test_fahrplan_refresh():
+    url = "https://data.c3voc.de/rC3_21/everything.schedule.json"
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        fahrplan = Fahrplan(conferences=["32c3", "rc3-2021"], use_snapshot=False, use_cache=False)
+        talks_32c3 = fahrplan.flat_plans[:10]
+        assert fahrplan.refresh() == []
+
+        schedule = json.load(open(data_dir / "rc3_21.json"))
+        schedule["schedule"]["version"] = "new version"
+        rooms = schedule["schedule"]["conference"]["days"][0]["rooms"]
+        first_room, second_room = list(rooms.values())[:2]
+        removed = first_room.pop()
+        moved = first_room.pop(0)
+        old_start = moved["start"]
+        moved["start"] = "23:00"
+        second_room.append(moved)
+        added = dict(removed, guid="b2b2b2b2-0000-0000-0000-000000000000", title="New talk")
+        second_room.append(added)
+        m.get(url, text=json.dumps(schedule))
+        fahrplan.build_indexes()
+        changes = fahrplan.refresh()
+
+    # refreshes don't keep the decoded schedules
+    assert len(fahrplan.fahrplans) == 2
+    # the indexes that were built are built again for the patched talks
+    assert fahrplan._time_index is not None and len(fahrplan._substring_indexes) == 4
+    assert moved["guid"] in [talk["talk_guid"] for talk in fahrplan.find(Query(start="23:00", room="all"))]
+    assert [talk["title"] for talk in fahrplan.search("New talk", limit=1)] == ["New talk"]
+    assert len(changes) == 1
+    assert changes[0].conference == "rc3-2021" and changes[0].new_version == "new version"
+    assert [talk["title"] for talk in changes[0].added] == ["New talk"]
+    assert [talk["talk_guid"] for talk in changes[0].removed] == [removed["guid"]]
+    assert [(old["talk_start"], new["talk_start"], new["talk_guid"]) for old, new in changes[0].moved] == [
+        (old_start, "23:00", moved["guid"])
+    ]
+    # unchanged talks are kept, the patched talks are the same as a fresh flatten
+    assert all(a is b for a, b in zip(fahrplan.flat_plans, talks_32c3))
+    assert [talk for talk in fahrplan.flat_plans if talk["conference_acronym"] == "rc3-2021"] == (
+        lib.flatten_fahrplan(schedule["schedule"])
+    )
+
+
+def test_diff_duplicate_guids():
+    # 33c3, 34c3 and 36c3 use some guids for more than one talk
+    first, second, third = (
+        Talk.from_dict(dict(talk, talk_guid="dup")) for talk in test_flat_talks[:3]
+    )
+    renamed = Talk.from_dict(dict(second.as_dict(), title="Renamed"))
+    changes = lib.diff_talks([first, second, third], [first, renamed, third])
+    assert (changes.added, changes.removed, changes.changed) == ([], [], [(second, renamed)])
+    changes = lib.diff_talks([first, second, third], [third, first])
+    assert (changes.added, changes.removed, changes.changed) == ([], [second], [])
+    changes = lib.diff_talks([first], [first, second])
+    assert (changes.added, changes.removed, changes.changed) == ([second], [], [])
+
+def imported_modules(module: str) -> dict:
+    """
+    Modules imported by `import module` in a fresh interpreter and their cumulative import time
+    in microseconds, as reported by python -X importtime
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=script_dir.parent,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_sources_and_mirror(tmp_path, capsys):
+    from pyfahrplan.config import conferences as builtin_conferences
+    from pyfahrplan.sources import load_sources, mirror, read_config
+
+    # a broken config is reported, the built in conferences still work
+    broken_config = tmp_path / "sources.json"
+    broken_config.write_text('{"conferences": ')
+    assert read_config(broken_config) == {}
+    assert "Could not read the sources config" in capsys.readouterr().err
+    # so is valid JSON of the wrong shape, only the broken parts are ignored
+    broken_config.write_text('{"conferences": ["37c3"], "mirror": 5, "other": 1}')
+    assert read_config(broken_config) == {"other": 1}
+    assert load_sources(config=read_config(broken_config))["36c3"] == builtin_conferences["36c3"]
+    broken_config.write_text('{"conferences": {"37c3": null}}')
+    assert read_config(broken_config) == {}
+    assert "no object of acronym -> location" in capsys.readouterr().err
+
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        results = mirror(load_sources(config={}, use_mirror=False), tmp_path / "mirror")
+        assert set(results.values()) == {"updated"}
+        assert set(mirror(load_sources(config={}), tmp_path / "mirror").values()) == {"unchanged"}
+        expected = Fahrplan(conferences=["36c3"], use_cache=False, use_snapshot=False)
+    # no request is mocked any more, the fahrplans come from the mirror
+    with requests_mock.Mocker():
+        sources = load_sources(config={"mirror": str(tmp_path / "mirror")})
+        assert sources["36c3"] == str(tmp_path / "mirror" / "36c3.schedule.json")
+        mirrored = Fahrplan(conferences=["36c3"], use_snapshot=False, sources=sources)
+        assert mirrored.flat_plans == expected.flat_plans
+        # further conferences from the config, as file url or path
+        local = {"local": (tmp_path / "mirror" / "32c3.schedule.json").as_uri()}
+        fahrplan = Fahrplan(conferences=["local"], use_snapshot=False, sources=local)
+        assert fahrplan.flat_plans == Fahrplan(conferences=["32c3"], use_snapshot=False, sources=sources).flat_plans
+
+
+def test_broken_entry_points(monkeypatch, capsys):
+    import importlib.metadata
+
+    from pyfahrplan import sources
+
+    class EntryPoint:
+        def __init__(self, name, provide):
+            self.name = name
+            self.provide = provide
+
+        def load(self):
+            return self.provide
+
+    def fail():
+        raise ImportError("plugin is broken")
+
+    found = [
+        EntryPoint("failing", fail),
+        EntryPoint("list", lambda: ["38c3"]),
+        EntryPoint("working", lambda: {"38c3": "https://example.org/38c3.json"}),
+    ]
+    monkeypatch.setattr(importlib.metadata, "entry_points", lambda **kwargs: found)
+    assert sources.load_sources(config={})["38c3"] == "https://example.org/38c3.json"
+    output = capsys.readouterr().err
+    assert "entry point failing failed" in output and "plugin is broken" in output
+    assert "entry point list returned no mapping" in output
+
+def test_schedule_cache(monkeypatch):
+    import requests
+
+    from pyfahrplan import snapshot
+
+    finished = "https://raw.githubusercontent.com/voc/36C3_schedule/master/everything.schedule.json"
+    running = "https://example.org/37c3/everything.schedule.json"
+    sources = {"36c3": finished, "37c3": running}
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        m.get(running, text=json.dumps(generate_schedule("37c3", talks=50)), headers={"ETag": '"v1"'})
+        cache = Fahrplan(sources=sources).cache
+        assert cache.is_immutable(finished) and not cache.is_immutable(running)
+        assert Fahrplan(sources=sources).fahrplans == []
+        assert m.call_count == 2
+        # the cache stores the digest of the content, a new flatten version reparses the schedules
+        monkeypatch.setattr(snapshot, "FLATTEN_VERSION", snapshot.FLATTEN_VERSION + 1)
+        assert len(Fahrplan(sources=sources).fahrplans) == 2
+        assert m.call_count == 2
+        # the running conference is revalidated once the ttl passed, the finished one never
+        later = time.time() + 2 * cache.ttl
+        m.get(running, status_code=304)
+        assert cache.fetch(requests.Session(), running, now=later).from_cache
+        assert m.last_request.headers["If-None-Match"] == '"v1"'
+        assert cache.fetch(requests.Session(), finished, now=later).from_cache
+        assert m.call_count == 3
+        # an outdated fahrplan is better than none
+        m.get(running, exc=requests.ConnectionError)
+        assert cache.fetch(requests.Session(), running, now=later + 2 * cache.ttl).from_cache
+
+    stats = {url_stats["url"]: url_stats for url_stats in cache.stats()}
+    assert [stats[finished][counter] for counter in ("hits", "revalidated", "downloads", "stale")] == [3, 0, 1, 0]
+    assert [stats[running][counter] for counter in ("hits", "revalidated", "downloads", "stale")] == [2, 1, 1, 1]
+    assert stats[finished]["hit_rate"] == 3 / 4
+    assert stats[finished]["stored_size"] < stats[finished]["size"] / 3
+    # the running conference was used last
+    assert cache.evict(stats[running]["stored_size"]) == [finished]
+    assert cache.get(running).read() == json.dumps(generate_schedule("37c3", talks=50)).encode()
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ["cache", "stats"])
+    assert result.exit_code == 0, result.output
+    assert "KiB of 64.0 MiB used" in result.output
+    result = runner.invoke(cli, ["cache", "stats", "--format", "json"])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)["cached"] for line in result.output.splitlines()] == [True, False]
+    result = runner.invoke(cli, ["cache", "prune", "--all"])
+    assert result.exit_code == 0 and running in result.output
+    assert cache.get(running) is None
+
+
+def test_broken_schedule_cache(tmp_path, monkeypatch, capsys):
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        expected = Fahrplan(conferences=["32c3"], use_snapshot=False).flat_plans
+        # a broken entry is downloaded again
+        cache = lib.new_cache()
+        url = lib.load_sources()["32c3"]
+        connection = sqlite3.connect(cache.path)
+        connection.execute("UPDATE entries SET content = ?", (b"not zlib",))
+        connection.commit()
+        connection.close()
+        assert Fahrplan(conferences=["32c3"], use_snapshot=False).flat_plans == expected
+        assert "has a broken entry" in capsys.readouterr().err
+        assert m.call_count == 2 and cache.get(url).read()
+        # a file that isn't a database is started over
+        cache.close()
+        for wal_file in tmp_path.glob("*.sqlite-*"):
+            wal_file.unlink()
+        cache.path.write_bytes(b"garbage" * 1000)
+        assert Fahrplan(conferences=["32c3"], use_snapshot=False).flat_plans == expected
+        assert "is broken, starting a new one" in capsys.readouterr().err
+        # a cache that can't be opened at all is done without
+        monkeypatch.setattr(lib, "cache_file", tmp_path)
+        assert Fahrplan(conferences=["32c3"], use_snapshot=False).flat_plans == expected
+        assert "can't be used" in capsys.readouterr().err
+
+
+def test_startup_does_not_import_heavy_modules():
+    for module in ["pyfahrplan.pyfahrplan_cli", "pyfahrplan.lib", "pyfahrplan.client"]:
+        modules = imported_modules(module)
+        assert module in modules
+        assert not {"requests", "requests_cache", "rich", "dateutil"} & set(modules), module
+
+
+def test_select_talks():
+    talks = test_flat_talks * 3
+    for sort_by in [None, "day", "room", "talk_start"]:
+        for reverse in [False, True]:
+            expected = list(talks)
+            if sort_by is not None:
+                expected.sort(key=lambda talk: str(talk[sort_by]))
+            if reverse:
+                expected.reverse()
+            assert list(select_talks(talks, sort_by, reverse)) == expected
+            assert list(select_talks(iter(talks), sort_by, reverse, limit=4)) == expected[:4]
+
+
+@mock_requests
+def test_cli_output_formats():
+    runner = CliRunner()
+    options = ["--no-server", "-c", "32c3", "-s", "carina", "--sort", "title"]
+    result = runner.invoke(cli, options + ["--format", "jsonl"])
+    assert result.exit_code == 0
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert rows and all("Carina" in row["speakers"] for row in rows)
+    assert [row["title"] for row in rows] == sorted(row["title"] for row in rows)
+    result = runner.invoke(cli, options + ["--format", "csv", "--limit", "1", "--show-abstract"])
+    assert result.exit_code == 0
+    header, first_row = list(csv.reader(result.output.splitlines(keepends=True)))
+    assert header[-1] == "Abstract" and first_row[5] == rows[0]["title"]
+    # status messages go to stderr, stdout stays valid jsonl
+    result = runner.invoke(cli, options + ["--changes", "--format", "jsonl"])
+    assert result.exit_code == 0 and result.stderr == "No fahrplan changed.\n"
+    assert [json.loads(line) for line in result.stdout.splitlines()] == rows
+
+
+def test_cli_timings(tmp_path):
+    options = ["--no-server", "-c", "32c3", "-s", "carina", "--format", "jsonl", "--timings"]
+    options += ["--timings-file", str(tmp_path / "timings.json"), "--profile", str(tmp_path / "run.prof")]
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        result = CliRunner().invoke(cli, options)
+    assert result.exit_code == 0
+    with open(tmp_path / "timings.json") as f:
+        timings = json.load(f)
+    assert (tmp_path / "run.prof").stat().st_size > 0
+    # the table goes to stderr, next to the talks
+    assert "flatten_fahrplans" in result.output
+    talks = result.output.count('"conference_title"')
+    assert talks and timings["stages"]["filter"]["talks"] == timings["stages"]["render"]["talks"] == talks
+    assert list(timings["urls"]) == [
+        "https://raw.githubusercontent.com/voc/32C3_schedule/master/everything.schedule.json"
+    ]
+    # recording stops with the cli
+    assert current_timings().enabled is False
+
+
+def test_batch():
+    now = dt.datetime(2016, 12, 28, 14, 0).astimezone()
+    queries = [
+        {"id": "carina", "speaker": "carina", "conference": "32c3"},
+        {"id": "hall 1", "room": "hall 1", "conference": "32c3", "day": 1, "no_past": True},
+        {"room": "hall 1", "conference": "c3", "start": "14:00", "sort": "title", "limit": 2},
+        {"id": "search", "search": "privacy", "conference": "33c3", "limit": 3},
+        {"id": "typo", "romo": "hall 1"},
+        {"id": "match", "speaker": "carina", "speaker_match": "fuzzy"},
+    ]
+    specs = read_specs([json.dumps(query) for query in queries] + ["", "not json"])
+    with requests_mock.Mocker() as m:
+        register_fahrplans(m)
+        results = list(run_batch(specs, now=now))
+        assert list(run_batch(specs, processes=2, now=now)) == results
+        fahrplan = Fahrplan(conferences=conferences_matching("c3"))
+    assert [result["id"] for result in results] == ["carina", "hall 1", 3, "search", "typo", "match", 8]
+    assert "error" in results[4] and "error" in results[6]
+    assert "speaker_match has to be one of" in results[5]["error"]
+    expected = fahrplan.find(Query(room="hall 1", conference="32c3", day=1, filter_past=True, now=now))
+    assert results[1]["talks"] == [talk.as_dict() for talk in expected]
+    expected = select_talks(fahrplan.find(Query(room="hall 1", start="14:00", conference="c3")), "title", limit=2)
+    assert results[2]["talks"] == [talk.as_dict() for talk in expected]
+    expected = fahrplan.find(Query(conference="33c3"), search="privacy", limit=3)
+    assert results[3]["talks"] == [talk.as_dict() for talk in expected]
+
+
+def test_synthetic_schedules():
+    documents = synthetic_documents(1003, days=2, rooms=3)
+    with requests_mock.Mocker() as m:
+        for url, document in documents.items():
+            m.get(url, text=document)
+        fahrplan = Fahrplan(use_cache=False, use_snapshot=False)
+    assert len(fahrplan.flat_plans) == 1003
+    assert {talk["day"] for talk in fahrplan.flat_plans} == {0, 1}
+    assert {talk["room"] for talk in fahrplan.flat_plans} == {"Room A", "Room B", "Room C"}
+    assert find_regressions({"load": 0.5, "sort": 0.001}, {"load": 0.1, "sort": 0.0001}) == [
+        "load: 500.0 ms, baseline 100.0 ms"
+    ]
+
+
+@pytest.mark.skipif(not os.environ.get("PYFAHRPLAN_BENCHMARK"), reason="set PYFAHRPLAN_BENCHMARK")
+def test_benchmark_regressions():
+    results = run_benchmarks(10000)
+    assert find_regressions(results, load_baselines()["10000"]) == []
+
+
 def test_conference_filter():
     filtered_talk = filter_talk(test_flat_talks[0], conference="32c3")
     filtered_talk_2 = filter_talk(test_flat_talks[0], conference="rc")